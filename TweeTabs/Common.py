@@ -23,17 +23,14 @@ A Twitter reader and personal manager - Common definitions.
 
 from xml.sax.saxutils import escape
 
-import pygtk
-pygtk.require('2.0')
-
 class Error(Exception):
     pass
 
 # The TweeTabs configuration directory, patched in from Main.
 configdir = None
 
-# If threading should be used, patched in from Main.
-threaded = False
+# If running without GTK nor widgets, patched in from Main.
+headless = False
 
 # The single instance of the Gui, patched in from Main.
 gui = None
@@ -24,7 +24,7 @@ A Twitter reader and personal manager - (part of) User Interface.
 __metaclass__ = type
 import gtk
 
-import Common, Scheduler, Tab
+import Common, Outbox, Tab
 
 class Error(Common.Error):
     pass
@@ -116,12 +116,7 @@ class Gui:
         self.widget.show_all()
         self.count_widget.hide()
         self.message('☺')
-        if Common.threaded:
-            gtk.gdk.threads_init()
-            gtk.gdk.threads_enter()
         gtk.main()
-        if Common.threaded:
-            gtk.gdk.threads_leave()
 
     def refresh(self):
         while gtk.events_pending():
@@ -233,10 +228,12 @@ class Gui:
             self.twitter_message_widget = gtk.Label()
             self.twitter_error_widget = gtk.Label()
             self.twitter_limits_widget = gtk.Label()
+            self.outbox_widget = gtk.Label()
 
             hbox = gtk.HBox(False, self.spacing)
             hbox.pack_start(self.gui_message_widget, False)
             hbox.pack_end(self.twitter_limits_widget, False)
+            hbox.pack_end(self.outbox_widget, False)
             hbox.pack_end(self.twitter_error_widget, False)
             hbox.pack_end(self.twitter_message_widget, False)
             return hbox
@@ -279,17 +276,7 @@ class Gui:
             if self.read_only_mode:
                 self.error("Sending inhibited")
             else:
-                Scheduler.Thread(self.send_tweet_thread(text))
-
-    def send_tweet_thread(self, text):
-        yield 0
-        while True:
-            try:
-                Common.twitter.send_tweet(text)
-            except Common.Error:
-                yield 10
-            else:
-                break
+                Outbox.outbox.add(text)
 
     @callback
     def file_quit_cb(self, action):
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+"""\
+A Twitter reader and personal manager - Rate limiting.
+"""
+
+__metaclass__ = type
+import atexit, os
+
+class Budget:
+
+    # A budget is a number of Twitter API hits allowed within a window of
+    # time, after which Twitter replenishes it.  Hits are granted as tokens
+    # taken out of a bucket.  The bucket refills at the exact pace needed
+    # for the remaining hits to spread over what remains of the window, and
+    # never holds more than a few tokens, so bursts are kept short.  Tokens
+    # in the bucket are part of the remaining hits, so the budget may be
+    # entirely used, yet never exceeded.
+
+    # All times are in seconds since the epoch, as given by the caller.
+
+    window = 60 * 60
+    burst = 3
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        # Until Twitter tells or a previous run saved otherwise, be prudent.
+        self.remaining = limit // 2
+        # Time at which Twitter replenishes the budget, None if unknown.
+        self.reset = None
+        self.tokens = 1.0
+        # Time of the last bucket refill, None if never.
+        self.stamp = None
+        # Time Twitter last told about this budget, None if never.
+        self.updated = None
+
+    def __str__(self):
+        return '%s/%s' % (self.remaining, self.limit)
+
+    def update(self, remaining, limit, reset, now):
+        # Synchronise with what Twitter reports.
+        self.refill(now)
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.tokens = min(self.tokens, remaining)
+        self.updated = now
+
+    def refill(self, now):
+        if self.reset is None:
+            self.reset = now + self.window
+        if now >= self.reset:
+            windows = 1 + int((now - self.reset) // self.window)
+            self.reset += windows * self.window
+            self.remaining = self.limit
+            self.tokens = min(1.0, self.remaining)
+            self.stamp = now
+        if self.stamp is None:
+            self.tokens = min(self.tokens, self.remaining)
+        elif now > self.stamp:
+            self.tokens = min(self.burst, self.remaining,
+                              self.tokens + (now - self.stamp) * self.rate())
+        self.stamp = now
+
+    def rate(self):
+        # Tokens per second, for the remaining hits to last until reset.
+        return max(0, self.remaining - self.tokens) / (self.reset - self.stamp)
+
+    def wait(self, now):
+        # Return how many seconds to wait before a hit may be granted.
+        self.refill(now)
+        # Forgive rounding errors, lest we wait forever for a last epsilon.
+        if self.tokens >= 1 - 1e-6:
+            return 0
+        rate = self.rate()
+        if rate == 0:
+            return self.reset - now
+        return (1 - self.tokens) / rate
+
+    def consume(self, now):
+        self.refill(now)
+        self.tokens = max(0, self.tokens - 1)
+        self.remaining = max(0, self.remaining - 1)
+
+class Limiter:
+
+    # All Twitter budgets, indexed by name.  The "auth" budget is for
+    # authenticated requests, the "ip" budget for anonymous requests.
+    # The state of budgets may be saved in a file, so a new session does
+    # not have to guess how much of the current windows has been used.
+
+    file_name = None
+
+    def __init__(self):
+        self.budgets = {'auth': Budget('auth', 100), 'ip': Budget('ip', 100)}
+
+    def __getitem__(self, name):
+        return self.budgets[name]
+
+    def restore(self, file_name):
+        self.file_name = file_name
+        if os.path.exists(file_name):
+            for line in file(file_name):
+                fields = line.split()
+                if len(fields) == 4 and fields[0] in self.budgets:
+                    budget = self.budgets[fields[0]]
+                    try:
+                        budget.limit = int(fields[1])
+                        budget.remaining = int(fields[2])
+                        budget.reset = float(fields[3])
+                    except ValueError:
+                        pass
+        atexit.register(self.save)
+
+    def save(self):
+        write = file(self.file_name, 'w').write
+        for name, budget in sorted(self.budgets.iteritems()):
+            if budget.reset is not None:
+                write('%s %d %d %.3f\n' % (name, budget.limit,
+                                           budget.remaining, budget.reset))
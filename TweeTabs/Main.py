@@ -27,34 +27,51 @@ Options:
   -g WIDTHxHEIGHT   Set minimum geometry (default 300x200)
   -c CONFIG_DIR     Configuration directory (default ~/.tweetabs)
   -n                Do not use any default tab setup
+  -H                Headless, run the tab engine without GTK, as a service
+  -b, --batch       Headless, load all sources once, save outputs and exit
 
 Debugging options:
-  -r   Read-only mode, no tweet sending, no destructive operations
-  -t   Use a separate thread for the Twitter manager
-  -i   Stay in Python when the program exits
+  -r           Read-only mode, no tweet sending, no destructive operations
+  -w WORKERS   Threads for network calls (default 4, 0 for none)
+  -i           Stay in Python when the program exits
+  -s SECONDS   Dump thread and endpoint statistics on stderr every SECONDS
+  -R SCRIPT    Replay SCRIPT in simulated time, without GTK, then report
 """
 
 __metaclass__ = type
-import gobject, gtk, os, sys
+import os, sys
 
-import Common, Scheduler
+import Common, Retry, Scheduler
 
 class Main:
     initial_tabsetup = True
     geometry = None
     read_only_mode = None
+    stats_period = None
+    replay_script = None
+    batch_mode = False
+    # Seconds allowed for all sources to load, in batch mode.
+    batch_deadline = 30 * 60
+    # Exit status once the headless loop ends.
+    exit_status = 0
 
     def main(self, *arguments):
 
         # Decode options.
         import getopt
-        options, arguments = getopt.getopt(arguments, 'c:hig:nrt')
+        options, arguments = getopt.getopt(arguments, 'bc:hHig:nrR:s:w:',
+                                           ['batch'])
         for option, value in options:
-            if option == '-c':
+            if option in ('-b', '--batch'):
+                self.batch_mode = True
+                Common.headless = True
+            elif option == '-c':
                 Common.configdir = value
             elif option == '-h':
                 sys.stdout.write(__doc__)
                 return
+            elif option == '-H':
+                Common.headless = True
             elif option == '-i':
                 os.putenv('PYTHONINSPECT', '1')
             elif option == '-g':
@@ -63,13 +80,34 @@ class Main:
                 self.initial_tabsetup = False
             elif option == '-r':
                 self.read_only_mode = True
-            elif option == '-t':
-                Common.threaded = True
+            elif option == '-R':
+                self.replay_script = value
+                Common.headless = True
+            elif option == '-s':
+                self.stats_period = float(value)
+            elif option == '-w':
+                Scheduler.scheduler.executor.workers = int(value)
         if Common.configdir is None:
             Common.configdir = os.path.expanduser('~/.tweetabs')
 
+        # The GTK version is selected before any module imports gtk.
+        if not Common.headless:
+            import pygtk
+            pygtk.require('2.0')
+
         # Should only be imported after option decoding.
-        import Gui, Twitter, Strip, Tab
+        import Tab, Twitter, Strip
+
+        # A replay is simulated, so it does not use nor save real limits.
+        if self.replay_script is not None:
+            import Replay
+            Replay.replay(self.replay_script, self)
+            return
+        Scheduler.scheduler.limiter.restore(Common.configdir + '/rate-limits')
+        if Common.headless:
+            self.run_headless()
+            return
+        import Gui
 
         # Push some options into Gui.
         if self.geometry is not None:
@@ -80,22 +118,91 @@ class Main:
             Gui.Gui.read_only_mode = True
 
         # Read in default initialization as set by user.
-        if os.path.exists(Common.configdir + '/defaults.py'):
-            context = {'Gui': Gui.Gui, 'Strip': Strip, 'Twitter': Twitter}
-            execfile(Common.configdir + '/defaults.py', context, {})
-        if Twitter.user is None or Twitter.password is None:
-            sys.exit("Twitter user not set, set it in your defaults.py file.")
+        self.load_defaults(Gui.Gui)
 
         # Prepare the GUI (first), then the Twitter manager.
         Common.gui = Gui.Gui()
-        if Common.threaded:
-            Common.twitter = Twitter.Threaded_Twitter()
-        else:
-            Common.twitter = Twitter.Twitter()
-        Scheduler.Thread(self.get_auth_limit_thread())
-        Scheduler.Thread(self.get_ip_limit_thread())
+        Common.twitter = Twitter.Twitter()
+        Scheduler.scheduler.executor.start()
+        self.start_threads()
 
         # Read in initial tab setup as set by user.
+        self.load_tabsetup()
+
+        # Resume sending tweets left over from previous sessions.
+        if not self.read_only_mode:
+            import Outbox
+            Outbox.outbox.restore(Common.configdir + '/outbox')
+
+        # Start the GUI.
+        try:
+            Common.gui.start()
+        except KeyboardInterrupt:
+            pass
+
+    def run_headless(self):
+        import Twitter
+        Scheduler.scheduler.backend = backend = Scheduler.Realtime_backend()
+        self.load_defaults(Gui_settings)
+        Common.twitter = Twitter.Twitter()
+        Scheduler.scheduler.executor.start()
+        self.start_threads()
+        self.load_tabsetup()
+        if self.batch_mode:
+            Scheduler.Thread(self.batch_thread())
+        try:
+            backend.run()
+        except KeyboardInterrupt:
+            pass
+        if self.exit_status:
+            sys.exit(self.exit_status)
+
+    def batch_thread(self):
+        # Once all sources got loaded, save all outputs and quit.  If some
+        # source did not load in time, report it and fail, saving nothing,
+        # as outputs would be incomplete.
+        import Planner, Tab
+        deadline = Scheduler.scheduler.now() + self.batch_deadline
+        while True:
+            missing = [source for source in Planner.planner.sources
+                       if not source.loaded]
+            if not missing:
+                break
+            if Scheduler.scheduler.now() >= deadline:
+                for source in missing:
+                    sys.stderr.write("Source never loaded: %s\n" % source)
+                for tab in Tab.Tab.registry.values():
+                    if isinstance(tab, Tab.Closeable):
+                        tab.modified = False
+                self.exit_status = 1
+                Scheduler.scheduler.backend.quit()
+                return
+            yield 1
+        for tab in Tab.Tab.registry.values():
+            if isinstance(tab, Tab.Closeable):
+                tab.flush()
+        Scheduler.scheduler.backend.quit()
+
+    def load_defaults(self, gui):
+        import Strip, Twitter
+        if os.path.exists(Common.configdir + '/defaults.py'):
+            context = {'Gui': gui, 'Strip': Strip, 'Twitter': Twitter}
+            execfile(Common.configdir + '/defaults.py', context, {})
+        if Twitter.user is None or Twitter.password is None:
+            sys.exit("Twitter user not set, set it in your defaults.py file.")
+
+    def start_threads(self):
+        Scheduler.Thread(self.get_limit_thread('auth', 120))
+        Scheduler.Thread(self.get_limit_thread('ip', 179))
+        Scheduler.Thread(Scheduler.scheduler.watchdog_thread(sys.stderr.write))
+        if self.stats_period is not None:
+            Scheduler.Thread(Scheduler.scheduler.dump_thread(
+                self.stats_period, sys.stderr.write))
+            Scheduler.Thread(Retry.policy.dump_thread(
+                self.stats_period, sys.stderr.write))
+
+    def load_tabsetup(self):
+        import Tab
         if self.initial_tabsetup:
             if os.path.exists(Common.configdir + '/tabsetup.py'):
                 context = dict(Tab.__dict__)
@@ -114,40 +221,31 @@ class Main:
                 friends.set_name("Friends")
                 user.goto()
 
-        # Start the Twitter manager (first), then the GUI.
-        if Common.threaded:
-            Common.twitter.start()
-        try:
-            Common.gui.start()
-        except KeyboardInterrupt:
-            pass
-        if Common.threaded:
-            try:
-                Common.twitter.enqueue(Common.twitter.quit)
-                Common.twitter.join()
-            except KeyboardInterrupt:
-                pass
-
-    def get_auth_limit_thread(self):
-        yield 0
-        while True:
-            try:
-                Common.twitter.get_auth_limit()
-            except Common.Error:
-                yield 20
-            else:
-                yield 120
-
-    def get_ip_limit_thread(self):
+    def get_limit_thread(self, name, period):
+        # Response headers normally keep the NAME budget up to date, so
+        # Twitter only gets asked after PERIOD seconds without news.
+        budget = Scheduler.scheduler.limiter[name]
+        get_limit = getattr(Common.twitter, 'get_%s_limit' % name)
         yield 0
+        attempt = 0
         while True:
+            silence = Scheduler.scheduler.now() - (budget.updated or 0)
+            if silence < period:
+                yield period - silence
+                continue
             try:
-                Common.twitter.get_ip_limit()
-            except Common.Error:
-                yield 20
+                yield get_limit()
+            except Common.Error, exception:
+                attempt += 1
+                yield Retry.policy.delay(attempt, exception)
             else:
-                yield 179
+                attempt = 0
  
+class Gui_settings:
+    # When headless, this stands for the Gui class within defaults.py, so
+    # GUI settings are accepted there, yet ignored.
+    pass
+
 run = Main()
 main = run.main
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+"""\
+A Twitter reader and personal manager - Outgoing tweets.
+"""
+
+__metaclass__ = type
+import os, simplejson
+
+import Common, Retry, Scheduler
+
+class Outbox:
+
+    # Tweets to send are first saved in a file, and only removed from it
+    # once Twitter got them, so they survive the end of the program.  A
+    # single thread sends them in order, each send being rate limited like
+    # any other request.  A send may fail after Twitter got the tweet, so
+    # before sending a tweet again, recent statuses of the user are checked
+    # for it, and the tweet is not sent twice.  A tweet Twitter refuses for
+    # good, say as a duplicate or too long, gets dropped and reported, so
+    # it does not block those after it.
+
+    file_name = None
+
+    def __init__(self):
+        # Each entry is a dictionary, with the tweet 'text', and the
+        # number of send 'attempts' so far.
+        self.entries = []
+        self.sending = False
+
+    def restore(self, file_name):
+        self.file_name = file_name
+        if os.path.exists(file_name):
+            try:
+                self.entries = simplejson.loads(file(file_name).read())
+            except ValueError:
+                # If anything is wrong, the file is rewritten at next save.
+                self.entries = []
+        self.start()
+
+    def save(self):
+        if self.file_name is None:
+            return
+        # Write a new file, then replace the old one, so a crash while
+        # writing may not lose what was already there.
+        handle = file(self.file_name + '.new', 'w')
+        handle.write(simplejson.dumps(self.entries))
+        handle.close()
+        os.rename(self.file_name + '.new', self.file_name)
+
+    def add(self, text):
+        # GTK gives UTF-8 strings, while Twitter statuses come as unicode,
+        # and both need to compare equal when checking sent tweets.
+        if isinstance(text, str):
+            text = text.decode('UTF-8')
+        self.entries.append({'text': text, 'attempts': 0})
+        self.save()
+        self.start()
+
+    def start(self):
+        self.display()
+        if self.entries and not self.sending:
+            self.sending = True
+            Scheduler.Thread(self.send_thread())
+
+    def send_thread(self):
+        attempt = 0
+        while self.entries:
+            entry = self.entries[0]
+            sending = False
+            try:
+                if entry['attempts']:
+                    yield True
+                    statuses = yield Common.twitter.get_own_statuses()
+                    sent = any(same_text(status.text, entry['text'])
+                               for status in statuses)
+                else:
+                    sent = False
+                if not sent:
+                    entry['attempts'] += 1
+                    self.save()
+                    self.display()
+                    yield True
+                    sending = True
+                    yield Common.twitter.send_tweet(entry['text'])
+            except Common.Error, exception:
+                if sending and Retry.policy.permanent(exception):
+                    attempt = 0
+                    self.entries.remove(entry)
+                    self.save()
+                    self.display()
+                    Common.twitter.error("Tweet dropped: "
+                                         + entry['text'].encode('UTF-8'))
+                    continue
+                attempt += 1
+                yield Retry.policy.delay(attempt, exception)
+            else:
+                attempt = 0
+                self.entries.remove(entry)
+                self.save()
+                self.display()
+        self.sending = False
+
+    def display(self):
+        if Common.headless:
+            return
+        widget = Common.gui.outbox_widget
+        if self.entries:
+            widget.set_markup('<span size="small">✉ %d</span>'
+                              % len(self.entries))
+            widget.set_tooltip_text(
+                    '\n'.join('%s (%d attempts)'
+                              % (entry['text'], entry['attempts'])
+                              for entry in self.entries))
+        else:
+            widget.set_label('')
+            widget.set_tooltip_text(None)
+
+def same_text(status_text, text):
+    # Twitter escapes some characters in returned statuses.
+    for before, after in ('&lt;', '<'), ('&gt;', '>'), ('&amp;', '&'):
+        status_text = status_text.replace(before, after)
+    return status_text.strip() == text.strip()
+
+outbox = Outbox()
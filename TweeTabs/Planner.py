@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+"""\
+A Twitter reader and personal manager - Polling plans.
+"""
+
+__metaclass__ = type
+import Common, Scheduler
+
+class Planner:
+
+    # The planner sees all sources at once, and decides when each should
+    # fetch again.  Each source asks for a polling rate, which is the
+    # inverse of its period, multiplied by a weight depending on how much
+    # the user may currently care about its tabs.  Whenever the sum of
+    # these rates is more than the "auth" budget may sustain, all rates
+    # shrink together, in proportion.  As tabs showing the same data share
+    # a source, the budget goes by distinct data, not by tabs.
+
+    # Part of the budget which polling may use, the remainder being left
+    # for other requests, like fetching user descriptions.
+    polling_share = 0.8
+
+    # Minimum seconds between the first fetches of successive sources.
+    stagger = 5
+
+    # Weights, from the current tab down to frozen tabs.
+    current_weight = 2
+    visible_weight = 1
+    hidden_weight = 0.5
+    frozen_weight = 0.25
+
+    def __init__(self):
+        self.sources = []
+        self.last_start = None
+
+    def register(self, source):
+        self.sources.append(source)
+        source.next_fetch = None
+        source.budget_share = 0
+
+    def unregister(self, source):
+        if source in self.sources:
+            self.sources.remove(source)
+
+    def first_delay(self, source):
+        # Spread first fetches, instead of having them all at once.
+        now = Scheduler.scheduler.now()
+        if (self.last_start is None
+                or self.last_start + self.stagger < now):
+            self.last_start = now
+        else:
+            self.last_start += self.stagger
+        source.next_fetch = self.last_start
+        return self.last_start - now
+
+    def delay(self, source):
+        # Return how many seconds to wait before SOURCE fetches again.
+        now = Scheduler.scheduler.now()
+        self.plan(now)
+        if source.budget_share:
+            budget = Scheduler.scheduler.limiter['auth']
+            rate = source.budget_share * self.budget_rate(budget, now)
+            delta = 1 / rate
+        else:
+            delta = source.period
+        source.next_fetch = now + delta
+        for other in self.sources:
+            for tab in other.tabs:
+                tab.update_tab_label()
+        return delta
+
+    def plan(self, now):
+        # Give each registered source its part of the budget.
+        budget = Scheduler.scheduler.limiter['auth']
+        budget_rate = self.budget_rate(budget, now)
+        wanted = {}
+        for source in self.sources:
+            wanted[source] = self.weight(source) / float(source.period)
+        total = sum(wanted.itervalues())
+        if not total or not budget_rate:
+            for source in self.sources:
+                source.budget_share = 0
+            return
+        scale = min(1, self.polling_share * budget_rate / total)
+        for source in self.sources:
+            source.budget_share = wanted[source] * scale / budget_rate
+
+    def budget_rate(self, budget, now):
+        # Hits per second the budget may sustain until its reset.
+        budget.refill(now)
+        if budget.reset <= now:
+            return 0
+        return budget.remaining / (budget.reset - now)
+
+    def weight(self, source):
+        # A source matters as much as its most important tab.
+        return max(map(self.tab_weight, source.tabs))
+
+    def tab_weight(self, tab):
+        if tab.frozen:
+            return self.frozen_weight
+        if tab.hidden:
+            return self.hidden_weight
+        if Common.gui is not None and tab is Common.gui.current_tab():
+            return self.current_weight
+        return self.visible_weight
+
+    def describe(self, source):
+        # A short human readout of the plan for SOURCE.
+        text = []
+        if source.next_fetch is not None:
+            seconds = max(0,
+                          int(source.next_fetch - Scheduler.scheduler.now()))
+            text.append("next fetch in %d:%.2d" % divmod(seconds, 60))
+        seconds = int(source.period)
+        text.append("every %d:%.2d" % divmod(seconds, 60))
+        if source.rate is not None:
+            text.append("%.1f new per hour" % (3600 * source.rate))
+        text.append("%.0f%% of budget" % (100 * source.budget_share))
+        if len(source.tabs) > 1:
+            text.append("shared by %d tabs" % len(source.tabs))
+        return ', '.join(text)
+
+planner = Planner()
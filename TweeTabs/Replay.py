@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+"""\
+A Twitter reader and personal manager - Simulated sessions.
+"""
+
+__metaclass__ = type
+import sys
+import twyt.twitter
+
+import Common, Retry, Scheduler
+
+class Script:
+
+    # A script is a Python file, which may set the following variables:
+    #   user        Twitter user name, used by User_timeline tabs.
+    #   start       Simulated time at start, in seconds since the epoch.
+    #   duration    Seconds of simulated time to run.
+    #   limit       Hits allowed per hour by the simulated Twitter.
+    #   responses   A dictionary from an API path, like 'friends/ids', to
+    #               a list of responses, given in turn, the last one being
+    #               repeated.
+    # A response is either a JSON string, an exception to raise, or a
+    # function receiving the simulated time and the call arguments, and
+    # returning a JSON string.
+
+    user = 'replay'
+    start = 1245000000.0
+    duration = 60 * 60
+    limit = 150
+
+    def __init__(self, file_name):
+        context = {}
+        execfile(file_name, context)
+        for name in 'user', 'start', 'duration', 'limit':
+            if name in context:
+                setattr(self, name, context[name])
+        self.responses = context.get('responses', {})
+
+class Scripted_twitter:
+
+    # This stands for the Twitter API, answering from a script rather
+    # than from the Web.  It also enforces the hourly limit the way Twitter
+    # would, counting any violation.
+
+    def __init__(self, script, backend):
+        self.script = script
+        self.backend = backend
+        self.calls = {}
+        self.violations = 0
+        self.reset = script.start + 60 * 60
+        self.remaining = script.limit
+
+    def api_call(self, method, path, authenticate=True, **arguments):
+        if path == 'account/rate_limit_status':
+            self.check_window()
+            return ('{"remaining_hits": %d, "hourly_limit": %d,'
+                    ' "reset_time_in_seconds": %d, "reset_time": ""}'
+                    % (self.remaining, self.script.limit, self.reset))
+        return self.respond(path, (), arguments)
+
+    def respond(self, name, args, kws):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.check_window()
+        if self.remaining == 0:
+            self.violations += 1
+            raise twyt.twitter.TwitterException("Rate limit exceeded")
+        self.remaining -= 1
+        responses = self.script.responses.get(name)
+        if not responses:
+            raise twyt.twitter.TwitterException("No response for " + name)
+        count = self.calls[name]
+        response = responses[min(count, len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        if callable(response):
+            return response(self.backend.now(), *args, **kws)
+        return response
+
+    def check_window(self):
+        now = self.backend.now()
+        while now >= self.reset:
+            self.reset += 60 * 60
+            self.remaining = self.script.limit
+
+def replay(file_name, main):
+    # Run the tab setup of MAIN against the script in FILE_NAME, in
+    # simulated time, then report on the session.
+    import Twitter
+    script = Script(file_name)
+    backend = Scheduler.Virtual_backend(script.start)
+    Scheduler.scheduler.backend = backend
+    Scheduler.scheduler.executor = Scheduler.Executor(0)
+    twitter = Scripted_twitter(script, backend)
+    Twitter.api_call = twitter.api_call
+    Twitter.user = script.user
+    Common.twitter = Twitter.Twitter()
+    main.start_threads()
+    main.load_tabsetup()
+    backend.run(script.start + script.duration)
+    write = sys.stdout.write
+    write("Simulated %d seconds, %d limit violations\n"
+          % (backend.now() - script.start, twitter.violations))
+    for name, count in sorted(twitter.calls.iteritems()):
+        write("%-40s %5d\n" % (name, count))
+    Scheduler.scheduler.dump(write)
+    Retry.policy.dump(write)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+"""\
+A Twitter reader and personal manager - Retry policy.
+"""
+
+__metaclass__ = type
+import random, threading
+
+import Common, Scheduler
+
+class Unavailable(Common.Error):
+    # Raised instead of calling an endpoint while its breaker is open.
+
+    def __init__(self, endpoint, retry_after):
+        Common.Error.__init__(self, "%s unavailable for %d seconds"
+                              % (endpoint, retry_after))
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+class Breaker:
+
+    # A circuit breaker for a single endpoint.  After threshold failures
+    # in a row, or when Twitter asks to come back later, the breaker opens,
+    # and calls are refused at once, without reaching Twitter, until its
+    # cool down delay passes.  A single call is then let through, as a
+    # probe.  If it succeeds, the breaker closes, otherwise it opens again
+    # for twice as long, up to maximum_cool_down.
+
+    threshold = 5
+    cool_down = 30
+    maximum_cool_down = 30 * 60
+
+    def __init__(self):
+        # One of 'closed', 'open' or 'probing'.
+        self.state = 'closed'
+        # Failures in a row.
+        self.failures = 0
+        self.delay = self.cool_down
+        # Time at which an open breaker lets a probe through.
+        self.until = None
+        self.calls = 0
+        self.failed = 0
+        self.refused = 0
+        self.retries = 0
+
+    def allow(self, now):
+        if self.state == 'open' and now >= self.until:
+            self.state = 'probing'
+            self.calls += 1
+            return True
+        if self.state == 'closed':
+            self.calls += 1
+            return True
+        self.refused += 1
+        return False
+
+    def succeed(self):
+        self.state = 'closed'
+        self.failures = 0
+        self.delay = self.cool_down
+
+    def fail(self, now, retry_after):
+        self.failures += 1
+        self.failed += 1
+        if self.state == 'probing':
+            self.delay = min(2 * self.delay, self.maximum_cool_down)
+        elif self.failures < self.threshold and not retry_after:
+            return
+        self.state = 'open'
+        self.until = now + max(self.delay, retry_after or 0)
+
+class Policy:
+
+    # All Twitter calls go through the policy, which keeps a breaker per
+    # endpoint, so a failing endpoint goes quiet while others continue.
+    # Threads retrying a failed call ask the policy how long to wait.
+    # Delays grow exponentially with the attempts, from base_delay up to
+    # maximum_delay, and are randomly shortened by up to jitter of their
+    # value, so many threads failing together do not retry together.  A
+    # retry-after hint from Twitter is never cut short.  Calls happen
+    # within executor workers, so breakers are protected by a lock.
+
+    base_delay = 10
+    maximum_delay = 15 * 60
+    jitter = 0.5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Breakers, indexed by endpoint.
+        self.breakers = {}
+
+    def call(self, endpoint, func, *args, **kws):
+        # Return FUNC(*ARGS, **KWS), on behalf of ENDPOINT.  Exceptions
+        # having a status attribute, for an HTTP status, only count as
+        # failures for server errors and requests to slow down.
+        now = Scheduler.scheduler.now()
+        self.lock.acquire()
+        try:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = self.breakers[endpoint] = Breaker()
+            allowed = breaker.allow(now)
+        finally:
+            self.lock.release()
+        if not allowed:
+            raise Unavailable(endpoint, max(0, breaker.until - now))
+        try:
+            result = func(*args, **kws)
+        except Exception, exception:
+            # Tell the retrying thread which breaker is concerned.
+            exception.endpoint = endpoint
+            retry_after = getattr(exception, 'retry_after', None)
+            status = getattr(exception, 'status', None)
+            self.lock.acquire()
+            try:
+                if (status is None or status >= 500 or status in (420, 429)
+                        or retry_after):
+                    breaker.fail(Scheduler.scheduler.now(), retry_after)
+                else:
+                    breaker.succeed()
+            finally:
+                self.lock.release()
+            raise
+        self.lock.acquire()
+        try:
+            breaker.succeed()
+        finally:
+            self.lock.release()
+        return result
+
+    def permanent(self, error):
+        # Tell if ERROR is a request Twitter refused for good, like an
+        # invalid or duplicate one, so retrying it is useless.  Failed
+        # authentication is not, as credentials may get fixed.
+        status = getattr(error, 'status', None)
+        return (status is not None and 400 <= status < 500
+                and status not in (401, 408, 420, 429)
+                and not getattr(error, 'retry_after', None))
+
+    def delay(self, attempt, error):
+        # Return seconds to wait before retrying, after ATTEMPT failures
+        # in a row, the last one raising ERROR.
+        endpoint = getattr(error, 'endpoint', None)
+        if endpoint in self.breakers:
+            self.breakers[endpoint].retries += 1
+        delay = min(self.maximum_delay, self.base_delay * 2 ** (attempt - 1))
+        delay *= 1 - self.jitter * random.random()
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    def dump(self, write):
+        write("%-40s %-7s %6s %6s %7s %7s\n"
+              % ("Endpoint", "State", "Calls", "Failed", "Refused",
+                 "Retries"))
+        for endpoint, breaker in sorted(self.breakers.iteritems()):
+            write("%-40s %-7s %6d %6d %7d %7d\n"
+                  % (endpoint, breaker.state, breaker.calls, breaker.failed,
+                     breaker.refused, breaker.retries))
+
+    def dump_thread(self, period, write):
+        while True:
+            yield period
+            self.dump(write)
+
+policy = Policy()
@@ -21,9 +21,13 @@
 A Twitter reader and personal manager - Thread handling.
 """
 
-import gobject, heapq, random, sys, time, traceback
+import Queue, heapq, math, os, random, sys, threading, time, traceback
 
-import Common
+import Common, Limiter
+
+# A thread may yield this to tell it is willing to continue at once,
+# unless the current time slice is used up.
+more = object()
 
 class Thread:
 
@@ -40,136 +44,719 @@ class Thread:
     # If that value is True, the delay is automatically chosen to slow down
     # the pace of requests to the Twitter API, as the Twitter site enforces a
     # limit of 100 requests per hour.  If that value is None, the "yield" is
-    # ignored and control returns immediately.  Once done with its work, the
-    # generator may either fall through its end, or do an explicit "return".
+    # ignored and control returns immediately.  If that value is "more",
+    # control returns immediately while the current time slice lasts, or
+    # else, at the next slice.  If that value is a Future, control returns
+    # once the future completes, and the "yield" expression then gives the
+    # result of the future, or raises its exception.  Once done with its
+    # work, the generator may either fall through its end, or do an explicit
+    # "return".
 
     # The second argument is either a single lock, a list or tuple of locks.
     # A thread acquires all of its locks at once before it starts, and
     # releases them all after it finishes.  So, a thread start will be
     # postponed until all its locks are free.
 
-    def __init__(self, iterator, locks=()):
+    # The optional "owner" argument is any object the thread works for, so
+    # all threads of an owner may be cancelled at once.  The optional
+    # "deadline" is a number of seconds after which the thread gets
+    # cancelled, if it did not finish by then.  A cancelled thread has its
+    # generator closed and its locks released, and is removed from any
+    # queue it was waiting in.
+
+    # For monitoring, each thread also records where it was created, the
+    # processor time it used, how many times it yielded, and how long it
+    # waited, by kind of wait.
+
+    def __init__(self, iterator, locks=(), owner=None, deadline=None):
         self.iterator = iterator
         if isinstance(locks, (list, tuple)):
             self.locks = locks
         else:
             self.locks = locks,
-        if scheduler.acquire_locks(self.locks):
+        self.owner = owner
+        if deadline is None:
+            self.deadline = None
+        else:
+            self.deadline = scheduler.now() + deadline
+        file_name, line, function, text = traceback.extract_stack(limit=2)[0]
+        self.site = '%s:%d (%s)' % (os.path.basename(file_name), line,
+                                    function)
+        self.cpu_time = 0.0
+        self.yields = 0
+        self.waits = {}
+        self.wait_kind = None
+        self.wait_start = None
+        self.holds_locks = False
+        self.running = False
+        self.cancelled = False
+        self.finished = False
+        # Value to send, or exception information to throw, when resuming.
+        self.sent = None
+        self.thrown = None
+        self.awaited = None
+        scheduler.add_thread(self)
+        if scheduler.acquire_locks(self):
             self.advance()
         else:
-            scheduler.lock_wait_queue.append(self)
+            scheduler.wait_for_locks(self)
+
+    def __str__(self):
+        return 'Thread from ' + self.site
+
+    def start_wait(self, kind):
+        self.wait_kind = kind
+        self.wait_start = scheduler.now()
+
+    def end_wait(self):
+        if self.wait_kind is not None:
+            self.waits[self.wait_kind] = (self.waits.get(self.wait_kind, 0)
+                                          + scheduler.now() - self.wait_start)
+            self.wait_kind = None
+
+    def expired(self):
+        return self.deadline is not None and scheduler.now() >= self.deadline
+
+    def cancel(self):
+        if self.finished:
+            return
+        self.cancelled = True
+        if self.running:
+            # The generator cancelled its own thread, advance() will notice.
+            return
+        scheduler.forget(self)
+        close = getattr(self.iterator, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except:
+                traceback.print_exc(file=sys.stderr)
+        scheduler.finish(self, cancelled=True)
 
     def advance(self):
+        self.end_wait()
         while True:
+            if self.cancelled or self.expired():
+                self.cancel()
+                return
+            start = time.clock()
+            self.running = True
             try:
-                delta = self.iterator.next()
+                try:
+                    if self.thrown is not None:
+                        thrown, self.thrown = self.thrown, None
+                        delta = self.iterator.throw(*thrown)
+                    elif self.sent is not None:
+                        sent, self.sent = self.sent, None
+                        delta = self.iterator.send(sent)
+                    else:
+                        delta = self.iterator.next()
+                finally:
+                    self.running = False
+                    self.cpu_time += time.clock() - start
             except StopIteration:
-                scheduler.release_locks(self.locks)
+                scheduler.finish(self)
                 return
             except:
                 traceback.print_exc(file=sys.stderr)
+                scheduler.finish(self, died=True)
                 return
+            self.yields += 1
+            if self.cancelled:
+                continue
+            if delta is more:
+                if scheduler.slice_exhausted():
+                    scheduler.delay(0, self)
+                    return
+                continue
             if delta is True:
                 scheduler.slow_down(self)
                 return
             if isinstance(delta, (int, float)):
                 scheduler.delay(delta, self)
                 return
+            if isinstance(delta, Future):
+                if delta.done:
+                    self.sent, self.thrown = delta.result, delta.exc_info
+                    continue
+                self.start_wait('future')
+                self.awaited = delta
+                delta.add_callback(self.future_done)
+                return
             assert delta is None, delta
 
+    def future_done(self, future):
+        self.awaited = None
+        self.sent, self.thrown = future.result, future.exc_info
+        self.advance()
+
 class Scheduler:
 
+    # Locks held for longer than this many seconds get reported.
+    lock_hold_threshold = 60
+
+    # Seconds of work allowed in a row, before giving control back to GTK.
+    slice_budget = 0.008
+
+    # Python threads for background work, like network calls.
+    workers = 4
+
+    # Seconds per tick.  Deadlines are rounded up to a whole tick, so all
+    # threads due within a same tick get resumed together.
+    tick = 0.01
+
     def __init__(self):
-        self.granted_locks = set()
-        self.lock_wait_queue = []
+        # Threads which did not finish yet.
+        self.threads = set()
+        # From an owner to the set of its unfinished threads.
+        self.owned_threads = {}
+        # Statistics for finished threads, indexed by creation site.
+        self.site_stats = {}
+        # From a granted lock to the time it was granted and its thread.
+        self.granted_locks = {}
+        # Statistics about locks, indexed by their printable name.
+        self.lock_stats = {}
+        # From a lock to the list of threads waiting for it, in arrival
+        # order.  A thread needing many locks is listed for each of them.
+        self.lock_waiters = {}
+        # A single GLib timeout is armed, for the earliest deadline.
         self.timeout_id = None
+        self.armed_deadline = None
+        self.armed_interval = None
         self.delayed_threads = []
         self.within_delay_loop = False
+        self.slice_start = None
         self.slowed_down_threads = []
+        self.slow_down_timeout_id = None
         self.within_slow_down_loop = False
-        self.create_slow_down_deltas()
+        self.limiter = Limiter.Limiter()
+        self.backend = Gobject_backend()
+        self.executor = Executor(self.workers)
 
-    def acquire_locks(self, locks):
-        for lock in locks:
+    def now(self):
+        return self.backend.now()
+
+    def acquire_locks(self, thread):
+        for lock in thread.locks:
             if lock in self.granted_locks:
                 return False
-        for lock in locks:
-            self.granted_locks.add(lock)
+        now = self.now()
+        for lock in thread.locks:
+            self.granted_locks[lock] = now, thread
+        thread.holds_locks = bool(thread.locks)
         return True
 
+    def wait_for_locks(self, thread):
+        thread.start_wait('lock')
+        for lock in thread.locks:
+            self.lock_waiters.setdefault(lock, []).append(thread)
+
+    def add_thread(self, thread):
+        self.threads.add(thread)
+        if thread.owner is not None:
+            self.owned_threads.setdefault(thread.owner, set()).add(thread)
+
+    def cancel_owner(self, owner):
+        # Cancel all unfinished threads working for OWNER.
+        for thread in list(self.owned_threads.get(owner, ())):
+            thread.cancel()
+
+    def forget(self, thread):
+        # Remove THREAD from whatever queue it is waiting in.
+        if thread.wait_kind == 'lock':
+            for lock in thread.locks:
+                waiters = self.lock_waiters[lock]
+                waiters.remove(thread)
+                if not waiters:
+                    del self.lock_waiters[lock]
+        elif thread.wait_kind == 'delay':
+            self.delayed_threads = [entry for entry in self.delayed_threads
+                                    if entry[1] is not thread]
+            heapq.heapify(self.delayed_threads)
+        elif thread.wait_kind == 'slow down':
+            self.slowed_down_threads.remove(thread)
+        elif thread.wait_kind == 'future':
+            thread.awaited.callbacks.remove(thread.future_done)
+            thread.awaited = None
+        thread.wait_kind = None
+
+    def finish(self, thread, died=False, cancelled=False):
+        thread.finished = True
+        self.threads.discard(thread)
+        if thread.owner is not None:
+            owned = self.owned_threads[thread.owner]
+            owned.discard(thread)
+            if not owned:
+                del self.owned_threads[thread.owner]
+        stats = self.site_stats.get(thread.site)
+        if stats is None:
+            stats = self.site_stats[thread.site] = {
+                    'threads': 0, 'died': 0, 'cancelled': 0, 'cpu': 0.0,
+                    'yields': 0, 'waits': {}}
+        stats['threads'] += 1
+        if died:
+            stats['died'] += 1
+            if thread.holds_locks:
+                sys.stderr.write("%s died while holding %s\n"
+                                 % (thread, ', '.join(map(str, thread.locks))))
+        if cancelled:
+            stats['cancelled'] += 1
+        stats['cpu'] += thread.cpu_time
+        stats['yields'] += thread.yields
+        for kind, value in thread.waits.iteritems():
+            stats['waits'][kind] = stats['waits'].get(kind, 0) + value
+        if thread.holds_locks:
+            thread.holds_locks = False
+            self.release_locks(thread.locks)
+
     def release_locks(self, locks):
+        # Only threads waiting on a released lock may possibly start now.
+        # Each is considered once, in the order it started waiting for that
+        # lock, and all those which may acquire their locks get started.
+        candidates = []
+        seen = set()
+        now = self.now()
         for lock in locks:
-            self.granted_locks.remove(lock)
-        for counter, thread in enumerate(self.lock_wait_queue):
-            if self.acquire_locks(thread.locks):
-                break
-        else:
-            return
-        del self.lock_wait_queue[counter]
-        thread.advance()
+            granted, holder = self.granted_locks.pop(lock)
+            stats = self.lock_stats.get(str(lock))
+            if stats is None:
+                stats = self.lock_stats[str(lock)] = {
+                        'grants': 0, 'held': 0.0, 'longest': 0.0}
+            stats['grants'] += 1
+            stats['held'] += now - granted
+            stats['longest'] = max(stats['longest'], now - granted)
+            for thread in self.lock_waiters.get(lock, ()):
+                if thread not in seen:
+                    seen.add(thread)
+                    candidates.append(thread)
+        started = []
+        for thread in candidates:
+            if self.acquire_locks(thread):
+                for lock in thread.locks:
+                    waiters = self.lock_waiters[lock]
+                    waiters.remove(thread)
+                    if not waiters:
+                        del self.lock_waiters[lock]
+                # The thread waits no more: should an earlier started thread
+                # cancel it, forget() must not look for it among waiters.
+                thread.end_wait()
+                started.append(thread)
+        # Locks are all granted before any thread advances, as advancing
+        # may release other locks and re-enter this method.
+        for thread in started:
+            thread.advance()
 
     # Delayed threads contains a priority queue of (Future, Thread), where
     # Future is a wanted time for resuming Thread.
 
     def delay(self, delta, thread):
-        now = time.time()
-        future = now + delta
+        now = self.now()
+        if delta > 0:
+            future = math.ceil((now + delta) / self.tick) * self.tick
+        else:
+            # A thread continuing after its time slice should not idle
+            # until the next tick, it only lets due threads go first.
+            future = now
+        if thread.deadline is not None:
+            future = min(future, thread.deadline)
+        thread.start_wait('delay')
         heapq.heappush(self.delayed_threads, (future, thread))
-        if not self.within_delay_loop:
-            if self.timeout_id is not None:
-                gobject.source_remove(self.timeout_id)
-            delta = max(10, int(1000 * (self.delayed_threads[0][0] - now)))
-            self.timeout_id = gobject.timeout_add(delta, self.delay_loop)
+        if not self.within_delay_loop and (self.armed_deadline is None
+                                           or future < self.armed_deadline):
+            self.arm_delay(now)
+
+    def arm_delay(self, now):
+        if self.timeout_id is not None:
+            self.backend.source_remove(self.timeout_id)
+        self.armed_deadline = self.delayed_threads[0][0]
+        self.armed_interval = self.interval(self.armed_deadline, now)
+        self.timeout_id = self.backend.timeout_add(self.armed_interval,
+                                              self.delay_loop)
+
+    def interval(self, deadline, now):
+        # Milliseconds from NOW to DEADLINE, rounded up.
+        return max(0, int(math.ceil(1000 * (deadline - now))))
 
     def delay_loop(self):
+        # Resume threads which are due, until the time slice is used up.
+        # GTK gets control once per slice, rather than once per thread.
         self.within_delay_loop = True
-        now = time.time()
+        now = self.slice_start = self.now()
         while self.delayed_threads and now >= self.delayed_threads[0][0]:
             future, thread = heapq.heappop(self.delayed_threads)
             thread.advance()
-            Common.gui.refresh()
-            now = time.time()
-        if self.delayed_threads:
-            delta = max(10, int(1000 * (self.delayed_threads[0][0] - now)))
-        else:
-            delta = 5000
-        self.timeout_id = gobject.timeout_add(delta, self.delay_loop)
+            now = self.now()
+            if self.slice_exhausted():
+                break
+        self.backend.refresh()
+        self.slice_start = None
         self.within_delay_loop = False
+        if not self.delayed_threads:
+            # Nothing to wait for, so let the timeout go.
+            self.timeout_id = self.armed_deadline = None
+            return False
+        now = self.now()
+        deadline = self.delayed_threads[0][0]
+        if self.interval(deadline, now) == self.armed_interval:
+            # GLib re-arms the same timeout by itself.
+            self.armed_deadline = deadline
+            return True
+        self.timeout_id = None
+        self.arm_delay(now)
+        return False
+
+    def slice_exhausted(self):
+        # Outside the delay loop, a slice starts with the first question.
+        now = self.now()
+        if self.slice_start is None:
+            self.slice_start = now
+        return now - self.slice_start >= self.slice_budget
 
     # Postponed threads contain a list of threads to resume, each after
     # some slowdown time to protect against Twitter API rate limiting.
-    # These are resumed in random order instead of first in / first out,
-    # as an heuristic way to give everything a more equal chance, in case
-    # of lot of related threads get added in a row.
+    # Each resumed thread consumes one hit from the "auth" budget, and
+    # threads are released as soon as, but no sooner than, the budget
+    # allows.  These are resumed in random order instead of first in /
+    # first out, as an heuristic way to give everything a more equal
+    # chance, in case of lot of related threads get added in a row.
 
     def slow_down(self, thread):
+        thread.start_wait('slow down')
         self.slowed_down_threads.append(thread)
         if (not self.within_slow_down_loop
                 and len(self.slowed_down_threads) == 1):
-            gobject.timeout_add(1000 * self.slow_down_delta(),
-                                self.slow_down_loop)
+            self.arm_slow_down()
 
     def slow_down_loop(self):
         self.within_slow_down_loop = True
-        pick = random.randint(0, len(self.slowed_down_threads) - 1) 
-        self.slowed_down_threads.pop(pick).advance()
-        Common.twitter.auth_limit -= 1
+        self.slow_down_timeout_id = None
+        budget = self.limiter['auth']
+        while self.slowed_down_threads and budget.wait(self.now()) == 0:
+            pick = random.randint(0, len(self.slowed_down_threads) - 1)
+            thread = self.slowed_down_threads.pop(pick)
+            if not thread.expired():
+                budget.consume(self.now())
+            thread.advance()
         if self.slowed_down_threads:
-            gobject.timeout_add(1000 * self.slow_down_delta(),
-                                self.slow_down_loop)
+            self.arm_slow_down()
         self.within_slow_down_loop = False
+        return False
+
+    def arm_slow_down(self):
+        if self.slow_down_timeout_id is not None:
+            self.backend.source_remove(self.slow_down_timeout_id)
+        delta = self.limiter['auth'].wait(self.now())
+        self.slow_down_timeout_id = self.backend.timeout_add(
+                max(10, int(1000 * delta)), self.slow_down_loop)
+
+    def update_budget(self, name, remaining, limit, reset):
+        # Twitter told us about a budget, so pacing may change.
+        self.limiter[name].update(remaining, limit, reset, self.now())
+        if self.slowed_down_threads and not self.within_slow_down_loop:
+            self.arm_slow_down()
+
+    ## Monitoring.
+
+    def stats(self):
+        # Return statistics per creation site, live threads included.
+        result = {}
+        for site, stats in self.site_stats.iteritems():
+            result[site] = dict(stats, waits=dict(stats['waits']), live=0)
+        for thread in self.threads:
+            stats = result.get(thread.site)
+            if stats is None:
+                stats = result[thread.site] = {
+                        'threads': 0, 'died': 0, 'cancelled': 0, 'cpu': 0.0,
+                        'yields': 0, 'waits': {}, 'live': 0}
+            stats['live'] += 1
+            stats['cpu'] += thread.cpu_time
+            stats['yields'] += thread.yields
+            for kind, value in thread.waits.iteritems():
+                stats['waits'][kind] = stats['waits'].get(kind, 0) + value
+        return result
+
+    def dump(self, write):
+        write("%-40s %5s %5s %4s %4s %9s %7s  %s\n"
+              % ("Thread site", "Done", "Live", "Died", "Cncl", "CPU",
+                 "Yields", "Waits"))
+        for site, stats in sorted(self.stats().iteritems(),
+                                  key=lambda item: -item[1]['cpu']):
+            waits = ', '.join('%s %.1f' % item
+                              for item in sorted(stats['waits'].iteritems()))
+            write("%-40s %5d %5d %4d %4d %9.3f %7d  %s\n"
+                  % (site, stats['threads'], stats['live'], stats['died'],
+                     stats['cancelled'], stats['cpu'], stats['yields'],
+                     waits))
+        write("%-40s %5s %9s %9s\n" % ("Lock", "Grants", "Held", "Longest"))
+        for lock, stats in sorted(self.lock_stats.iteritems()):
+            write("%-40s %5d %9.3f %9.3f\n"
+                  % (lock, stats['grants'], stats['held'], stats['longest']))
+
+    def dump_thread(self, period, write):
+        while True:
+            yield period
+            self.dump(write)
+
+    def watchdog_thread(self, write):
+        # Report threads holding locks for too long, once per grant.
+        reported = set()
+        while True:
+            yield self.lock_hold_threshold / 2.0
+            now = self.now()
+            for lock, (granted, thread) in self.granted_locks.iteritems():
+                if (now - granted > self.lock_hold_threshold
+                        and (lock, granted) not in reported):
+                    reported.add((lock, granted))
+                    write("%s holds %s for %.0f seconds\n"
+                          % (thread, lock, now - granted))
+            for lock, granted in list(reported):
+                if self.granted_locks.get(lock, (None,))[0] != granted:
+                    reported.discard((lock, granted))
+
+## Background work.
+
+class Future:
+
+    # A future stands for the outcome of some work done in background.
+    # Once done, it holds either a result, or the exception information
+    # of what went wrong.  Futures complete within the main loop, so their
+    # callbacks are never called from other Python threads.
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.exc_info = None
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        # CALLBACK receives the future, once it completes.
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def then(self, func, *args):
+        # Return a future for FUNC(result, *ARGS), called within the main
+        # loop once this future succeeds.  A failure is passed along.
+        future = Future()
+
+        def callback(self):
+            if self.exc_info is not None:
+                future.complete(exc_info=self.exc_info)
+                return
+            try:
+                result = func(self.result, *args)
+            except:
+                future.complete(exc_info=sys.exc_info())
+            else:
+                future.complete(result)
+
+        self.add_callback(callback)
+        return future
+
+    def complete(self, result=None, exc_info=None):
+        self.done = True
+        self.result = result
+        self.exc_info = exc_info
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+class Executor:
+
+    # A bounded pool of Python threads, for blocking work like network
+    # calls.  Without workers, work is done at once, when submitted.
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.queue = Queue.Queue()
+        self.started = False
+
+    def submit(self, func, *args, **kws):
+        # Return a future for FUNC(*ARGS, **KWS).
+        future = Future()
+        if self.workers:
+            if not self.started:
+                self.start()
+            self.queue.put((future, func, args, kws))
+        else:
+            try:
+                future.complete(func(*args, **kws))
+            except:
+                future.complete(exc_info=sys.exc_info())
+        return future
+
+    def start(self):
+        if self.started or not self.workers:
+            return
+        self.started = True
+        scheduler.backend.threads_init()
+        for counter in range(self.workers):
+            worker = threading.Thread(target=self.work,
+                                      name="Worker %d" % (counter + 1))
+            worker.setDaemon(True)
+            worker.start()
+
+    def work(self):
+        while True:
+            future, func, args, kws = self.queue.get()
+            try:
+                result = func(*args, **kws)
+            except:
+                scheduler.backend.call_soon(future.complete, None,
+                                            sys.exc_info())
+            else:
+                scheduler.backend.call_soon(future.complete, result)
+
+## Backends.
+
+# A backend provides the clock and the event loop for the scheduler.
+
+class Gobject_backend:
+
+    # Real time, with the GLib main loop.  The gobject module is only
+    # imported when needed, so other backends do not require it.
+
+    def now(self):
+        return time.time()
+
+    def timeout_add(self, interval, func):
+        import gobject
+        return gobject.timeout_add(interval, func)
+
+    def source_remove(self, id):
+        import gobject
+        gobject.source_remove(id)
+
+    def call_soon(self, func, *args):
+        # May be called from any Python thread.
+        import gobject
+
+        def once():
+            func(*args)
+            return False
+
+        gobject.idle_add(once)
+
+    def threads_init(self):
+        import gobject
+        gobject.threads_init()
+
+    def refresh(self):
+        Common.gui.refresh()
+
+class Heap_backend:
+
+    # Timeouts kept in a priority queue of our own, for backends not
+    # using GLib.  The priority queue holds (When, Id, Interval, Func).
+
+    def __init__(self):
+        self.timeouts = []
+        self.last_id = 0
+        self.removed = set()
+
+    def timeout_add(self, interval, func):
+        self.last_id += 1
+        heapq.heappush(self.timeouts, (self.now() + interval / 1000.0,
+                                       self.last_id, interval, func))
+        return self.last_id
+
+    def source_remove(self, id):
+        self.removed.add(id)
+
+    def threads_init(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def next_timeout(self):
+        # Return the time of the next timeout, or None if there is none.
+        while self.timeouts and self.timeouts[0][1] in self.removed:
+            self.removed.remove(heapq.heappop(self.timeouts)[1])
+        if self.timeouts:
+            return self.timeouts[0][0]
+
+    def fire(self):
+        # Call the next timeout, and re-arm it if it returns True.
+        when, id, interval, func = heapq.heappop(self.timeouts)
+        if func():
+            heapq.heappush(self.timeouts, (self.now() + interval / 1000.0,
+                                           id, interval, func))
+
+class Virtual_backend(Heap_backend):
+
+    # Simulated time, for replays and benchmarks.  Nothing ever waits for
+    # real: running the backend jumps from one timeout to the next one, so
+    # hours of activity may be simulated in seconds, with exact timings.
+    # Background work should be done without workers, so it completes in
+    # simulated time.
+
+    def __init__(self, start=0.0):
+        Heap_backend.__init__(self)
+        self.clock = start
+
+    def now(self):
+        return self.clock
+
+    def call_soon(self, func, *args):
+
+        def once():
+            func(*args)
+            return False
+
+        self.timeout_add(0, once)
+
+    def run(self, until=None):
+        # Process timeouts, in order, until UNTIL or none remains.
+        while True:
+            when = self.next_timeout()
+            if when is None or until is not None and when > until:
+                break
+            self.clock = max(self.clock, when)
+            self.fire()
+        if until is not None:
+            self.clock = max(self.clock, until)
+
+class Realtime_backend(Heap_backend):
+
+    # Real time, with a simple event loop of our own, so the scheduler may
+    # run without GTK, for example within a long-lived service.  Other
+    # Python threads, like executor workers, hand work to the loop through
+    # call_soon, which wakes it up.
+
+    def __init__(self):
+        Heap_backend.__init__(self)
+        self.calls = Queue.Queue()
+        self.running = False
+
+    def now(self):
+        return time.time()
+
+    def call_soon(self, func, *args):
+        # May be called from any Python thread.
+        self.calls.put((func, args))
+
+    def run(self):
+        # Process timeouts and calls, until quit() gets called.
+        self.running = True
+        while self.running:
+            when = self.next_timeout()
+            if when is not None and when <= time.time():
+                self.fire()
+                continue
+            # Waiting is done in short pieces, as Python 2 does not let a
+            # KeyboardInterrupt through a blocking Queue.get.
+            timeout = 1
+            if when is not None:
+                timeout = min(timeout, when - time.time())
+            try:
+                func, args = self.calls.get(timeout=max(0, timeout))
+            except Queue.Empty:
+                continue
+            func(*args)
 
-    def create_slow_down_deltas(self):
-        a = 0
-        b = 1
-        deltas = []
-        while len(deltas) < 11 or b < 30 * 60:
-            a, b = b, a + b
-            deltas.append(a)
-        self.slow_down_deltas = deltas[-11:]
-
-    def slow_down_delta(self):
-        limit = max(0, min(100, Common.twitter.auth_limit))
-        return self.slow_down_deltas[(100 - limit) // 10]
+    def quit(self):
+        self.running = False
 
 scheduler = Scheduler()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+"""\
+A Twitter reader and personal manager - Shared data sources.
+"""
+
+__metaclass__ = type
+import Common, Planner, Retry, Scheduler, Strip, Tab
+
+class Source:
+
+    # A source stands for some Twitter data, as obtained by a Twitter
+    # service for given arguments.  All periodic tabs showing the same
+    # data subscribe to a single source, which alone fetches it, at the
+    # pace the planner decides for all of them, and gives what it gets to
+    # every subscribed tab.  As only the source thread fetches, there is
+    # never more than one request in flight for the same data.  The
+    # source also keeps what it got, so a tab subscribing later gets
+    # filled at once, without waiting nor costing a request.
+
+    # A source also adapts its period to how fast new strips arrive, as
+    # estimated by an exponentially weighted moving average of the rate
+    # seen by successive fetches.  The period is chosen so a fetch would
+    # bring about target_items new strips, within the given bounds.  So
+    # fetches bringing nothing new make the source back off by themselves.
+    # Until a rate is known, the shortest period of the tabs is used.
+
+    # Sources, indexed by source type, Twitter service and arguments.
+    registry = {}
+    capacity = 200
+    target_items = 10
+    minimum_period = 60
+    maximum_period = 2 * 60 * 60
+    # Weight of the latest fetch within the average, between 0 and 1.
+    smoothing = 0.3
+
+    def __init__(self, key):
+        self.key = key
+        self.service = key[1]
+        self.arguments = key[2]
+        self.tabs = []
+        self.strips = set()
+        # Becomes True after the first successful fetch.
+        self.loaded = False
+        # New strips per second, None until known.
+        self.rate = None
+        # New strips so far within the current fetch.
+        self.arrived = 0
+        # Time of the previous successful fetch, None if none yet.
+        self.fetched = None
+        Planner.planner.register(self)
+        Scheduler.Thread(self.periodic_fetch_thread(), owner=self)
+
+    def __str__(self):
+        return ' '.join((self.service,) + tuple(map(str, self.arguments)))
+
+    def period(self):
+        if self.rate is None:
+            return min(tab.period for tab in self.tabs)
+        if self.rate:
+            period = self.target_items / self.rate
+        else:
+            period = self.maximum_period
+        return max(self.minimum_period, min(self.maximum_period, period))
+    period = property(period)
+
+    def observe(self, now):
+        # Account for the strips which arrived since the previous fetch.
+        # The first fetch only brings the backlog, so it is not a rate.
+        if self.fetched is not None and now > self.fetched:
+            rate = self.arrived / (now - self.fetched)
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate += self.smoothing * (rate - self.rate)
+        self.fetched = now
+
+    def subscribe(self, tab):
+        self.tabs.append(tab)
+        if self.loaded:
+            tab.preset_strips |= self.strips
+            tab.refresh()
+
+    def unsubscribe(self, tab):
+        if tab in self.tabs:
+            self.tabs.remove(tab)
+        if not self.tabs:
+            Planner.planner.unregister(self)
+            Scheduler.scheduler.cancel_owner(self)
+            del Source.registry[self.key]
+
+    def periodic_fetch_thread(self):
+        yield Planner.planner.first_delay(self)
+        # Failed attempts in a row.
+        attempt = 0
+        while True:
+            self.arrived = 0
+            try:
+                more = yield self.fetch()
+                while more:
+                    yield True
+                    more = yield self.fetch_older()
+            except Common.Error, exception:
+                attempt += 1
+                yield Retry.policy.delay(attempt, exception)
+            else:
+                attempt = 0
+                self.loaded = True
+                self.observe(Scheduler.scheduler.now())
+                yield Planner.planner.delay(self)
+                yield True
+
+    def fetch(self):
+        # Return a future, which yields True when fetch_older should be
+        # called next.
+        return getattr(Common.twitter, self.service)(self, *self.arguments)
+
+    def add_strips(self, strips):
+        self.arrived += len(strips - self.strips)
+        self.strips |= strips
+        if len(self.strips) > self.capacity:
+            self.strips = set(
+                    sorted(self.strips, key=Strip.sort_key)[-self.capacity:])
+        # Tabs sharing the source get propagated together.
+        Tab.propagation.start()
+        try:
+            for tab in self.tabs:
+                tab.preset_strips |= strips
+                tab.refresh()
+        finally:
+            Tab.propagation.end()
+
+    def replace_strip(self, old, new):
+        # Have NEW stand for OLD from now on.  See Tab.replace_strip.
+        if new is not old and old in self.strips:
+            self.strips.remove(old)
+            self.strips.add(new)
+
+class Graph(Source):
+
+    # A social graph comes as pages of user ids, walked with a cursor.
+    # Each page is given to the tabs as a delta as soon as it comes, and
+    # users not met during a complete walk get removed once it ends.  So
+    # a big graph shows up progressively, and a new walk only changes
+    # what differs from the previous one.
+
+    capacity = None
+
+    def fetch(self):
+        self.cursor = -1
+        self.walked = set()
+        return Source.fetch(self)
+
+    def fetch_older(self):
+        return Source.fetch(self)
+
+    def page_added(self, strips):
+        # Merge a page of user STRIPS, and return True if the next page
+        # is needed.  The cursor has already been advanced.
+        self.walked |= strips
+        # Tabs sharing the source get propagated together.
+        Tab.propagation.start()
+        try:
+            self.add_strips(strips - self.strips)
+            if self.cursor:
+                return True
+            self.discard_strips(self.strips - self.walked)
+            del self.walked
+            return False
+        finally:
+            Tab.propagation.end()
+
+    def add_strips(self, strips):
+        self.arrived += len(strips)
+        self.strips |= strips
+        for tab in self.tabs:
+            tab.preset_strips |= strips
+            tab.add_strips(strips)
+
+    def replace_strip(self, old, new):
+        # A walk in progress should not lose NEW once it ends.
+        Source.replace_strip(self, old, new)
+        if hasattr(self, 'walked') and old in self.walked:
+            self.walked.remove(old)
+            self.walked.add(new)
+
+    def discard_strips(self, strips):
+        self.strips -= strips
+        for tab in self.tabs:
+            tab.preset_strips -= strips
+            tab.discard_strips(strips)
+
+class Timeline(Source):
+
+    # Only statuses newer than the newest one seen get fetched.  When a
+    # page comes back full, some statuses may still be missing between
+    # that page and the known ones, so older pages get fetched in turn,
+    # each being rate limited, until reaching known statuses.  Older pages
+    # are selected by max_id rather than by page number, as page numbers
+    # shift whenever new statuses arrive meanwhile.  After backfill_pages
+    # pages, the remaining gap is left as it is.
+
+    # Ids of the newest and oldest statuses seen so far.
+    newest_id = None
+    oldest_id = None
+    page_size = 20
+    backfill_pages = 10
+
+    def fetch(self):
+        # newest_id only moves once all pages are in, so if some page
+        # fails, the next fetch starts over from the same point.
+        self.since_id = self.newest_id
+        self.pending_id = None
+        self.max_id = None
+        self.page = 1
+        return Source.fetch(self)
+
+    def fetch_older(self):
+        self.page += 1
+        return Source.fetch(self)
+
+    def paging(self):
+        # Keyword arguments selecting the current page, for the API.
+        arguments = {}
+        if self.since_id is not None:
+            arguments['since_id'] = self.since_id
+        if self.max_id is not None:
+            arguments['max_id'] = self.max_id
+        return arguments
+
+    def page_added(self, statuses):
+        # Note the ids within a page of STATUSES, and return True if the
+        # next older page is needed.
+        if statuses:
+            ids = [status.id for status in statuses]
+            self.pending_id = max(self.pending_id, max(ids))
+            if self.oldest_id is None or min(ids) < self.oldest_id:
+                self.oldest_id = min(ids)
+            if (self.since_id is not None
+                    and len(ids) >= self.page_size
+                    and min(ids) > self.since_id
+                    and self.page < self.backfill_pages):
+                self.max_id = min(ids) - 1
+                return True
+        self.newest_id = max(self.newest_id, self.pending_id)
+        return False
+
+def subscribe(tab, maker, service, *arguments):
+    # Subscribe TAB to the source of type MAKER for the Twitter SERVICE
+    # called with ARGUMENTS, creating that source as needed.
+    key = maker, service, arguments
+    source = Source.registry.get(key)
+    if source is None:
+        source = Source.registry[key] = maker(key)
+    source.subscribe(tab)
+    return source
@@ -22,11 +22,15 @@ A Twitter reader and personal manager - Strip structures.
 """
 
 __metaclass__ = type
-import Image, ImageDraw, StringIO
-import anydbm, atexit, gtk, pango, re, simplejson, time, urllib
+import StringIO
+import anydbm, atexit, operator, re, simplejson, time, weakref
 import twyt.data
 
-import Common, Scheduler, Tab, Twitter
+import Common, Retry, Scheduler, Tab, Transport, Twitter
+
+if not Common.headless:
+    import Image, ImageDraw
+    import gtk, pango
 
 image_size = 60
 image_loader_capacity = 100 
@@ -65,20 +69,78 @@ class Visible_strip:
         else:
             self.select()
 
+# Strips may be many, so they are kept compact, without a __dict__, and
+# only retain what displaying them needs.  Strips compare through their
+# keys only, whatever their types, so strips read from a file may meet
+# users within set operations.  Sorting goes faster using key=sort_key,
+# as keys then compare directly, instead of strips.
+
+# Strips are also interned: making a strip for data which already has one
+# returns that same strip, its contents refreshed in place.  So a tweet or
+# a user is a single object, however many fetches and tabs got it.  As
+# the table only holds weak references, strips nobody uses go away.  When
+# the refresh changes the FIELDS a strip displays, the widgets showing it
+# get rebuilt.
+
+# From (strip type, key) to strip.
+interned = weakref.WeakValueDictionary()
+
 class Strip:
+    __slots__ = 'key', 'hash', '__weakref__'
+    fields = ()
     visible_maker = Visible_strip
 
+    def __new__(cls, data):
+        key = cls.key_of(data)
+        strip = interned.get((cls, key))
+        if strip is None:
+            strip = interned[cls, key] = object.__new__(cls)
+        return strip
+
     def __init__(self, key):
         self.key = key
+        self.hash = hash(key)
+
+    def key_of(cls, key):
+        return key
+    key_of = classmethod(key_of)
+
+    def contents(self):
+        # Return the displayed fields, or None for a strip being made.
+        if not hasattr(self, 'key'):
+            return None
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def refreshed(self, before):
+        # The strip got new contents in place, it had BEFORE.
+        if before is not None and self.contents() != before:
+            Tab.replace_strip(self, self)
 
     def __str__(self):
         return type(self).__name__ + ' ' + str(self.key)
 
-    def __cmp__(self, other):
-        return cmp(self.key, other.key)
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __le__(self, other):
+        return self.key <= other.key
+
+    def __gt__(self, other):
+        return self.key > other.key
+
+    def __ge__(self, other):
+        return self.key >= other.key
 
     def __hash__(self):
-        return hash(self.key)
+        return self.hash
+
+sort_key = operator.attrgetter('key')
 
 class Visible_tweet(Visible_strip):
 
@@ -157,7 +219,7 @@ class Visible_tweet(Visible_strip):
                                           style=pango.STYLE_ITALIC))
             return textview
 
-        status = self.strip.status
+        status = self.strip
 
         hbox = gtk.HBox()
         hbox.pack_start(image(), False, False, Common.gui.spacing)
@@ -194,11 +256,24 @@ class Visible_tweet(Visible_strip):
                 self.eventbox_widget.get_colormap().alloc_color('white'))
 
 class Tweet(Strip):
+    fields = 'text', 'created_at', 'source', 'user'
+    __slots__ = fields
     visible_maker = Visible_tweet
 
+    def key_of(cls, status):
+        return status.id
+    key_of = classmethod(key_of)
+
     def __init__(self, status):
-        self.status = status
+        before = self.contents()
         Strip.__init__(self, status.id)
+        self.text = status.text
+        self.created_at = status.created_at
+        # Direct messages have a sender instead of a user, and no source.
+        self.source = getattr(status, 'source', '')
+        self.user = User(getattr(status, 'user', None)
+                         or getattr(status, 'sender'))
+        self.refreshed(before)
 
 class Visible_user(Visible_strip):
 
@@ -259,7 +334,7 @@ class Visible_user(Visible_strip):
                                               underline=pango.UNDERLINE_SINGLE))
             return textview
 
-        user = self.strip.user
+        user = self.strip
 
         hbox = gtk.HBox()
         hbox.pack_start(image(), False, False, Common.gui.spacing)
@@ -296,11 +371,45 @@ class Visible_user(Visible_strip):
                 self.eventbox_widget.get_colormap().alloc_color('white'))
 
 class User(Strip):
+    fields = ('id', 'screen_name', 'name', 'location', 'description', 'url',
+              'profile_image_url')
+    __slots__ = fields
     visible_maker = Visible_user
 
+    def __new__(cls, user):
+        # A renamed user gets a new strip, as the key changes, but then
+        # the intern table forgets the old one, so there is still a single
+        # strip per user id.
+        old = users_by_id.get(user.id)
+        if old is not None and old.key != user.screen_name:
+            if interned.get((cls, old.key)) is old:
+                del interned[cls, old.key]
+        return Strip.__new__(cls, user)
+
     def __init__(self, user):
-        self.user = user
-        Strip.__init__(self, self.user.screen_name)
+        previous = users_by_id.get(user.id)
+        if previous is not None:
+            image_url = previous.profile_image_url
+        before = self.contents()
+        Strip.__init__(self, user.screen_name)
+        for name in self.fields:
+            setattr(self, name, getattr(user, name, None))
+        users_by_id[self.id] = self
+        if (previous is not None and image_loader is not None
+                and self.profile_image_url != image_url):
+            image_loader.forget(self.id)
+        # However the new name got known, through a lookup or within some
+        # tweet, tabs and widgets holding the previous strip switch to it.
+        if previous is not None and previous is not self:
+            Tab.replace_strip(previous, self)
+        self.refreshed(before)
+
+    def key_of(cls, user):
+        return user.screen_name
+    key_of = classmethod(key_of)
+
+# From user id to the current User strip for it.
+users_by_id = weakref.WeakValueDictionary()
 
 ## Text services.
 
@@ -345,6 +454,14 @@ class Image_loader:
         # The older Id at the beginning, the most recent at the end.
         self.lru = []
 
+    def forget(self, id):
+        # The image for user ID changed, so it gets loaded anew when needed.
+        if id in self.cache:
+            del self.cache[id]
+            self.lru.remove(id)
+        if self.db.has_key(str(id)):
+            del self.db[str(id)]
+
     def load(self, image, user):
         # Load an empty image now, so the layout computes faster.
         image.set_from_pixbuf(self.empty_pixbuf)
@@ -367,44 +484,63 @@ class Image_loader:
         self.lru.append(user.id)
         if len(self.lru) > image_loader_capacity:
             del self.cache[self.lru.pop(0)]
-        # Spread the image on all strips where is is already expected.
         yield 0
-        pixbuf = self.pixbuf_from_user(user)
+        # The database is only used from the main loop, while network and
+        # image work is left to executor workers, so the GUI never blocks.
+        id_string = str(user.id)
+        if self.db.has_key(id_string):
+            buffer = self.db[id_string]
+        else:
+            buffer = yield Scheduler.scheduler.executor.submit(
+                    self.download, user.profile_image_url)
+            if buffer is not None:
+                self.db[id_string] = buffer
+        im = None
+        if buffer is not None:
+            im = yield Scheduler.scheduler.executor.submit(
+                    self.image_from_buffer, buffer)
+        if im is None:
+            pixbuf = self.empty_pixbuf
+        else:
+            pixbuf = self.pixbuf_from_pil(im)
+        # Spread the image on all strips where is is already expected.
         if user.id in self.cache:
             images = self.cache[user.id][1]
             self.cache[user.id] = pixbuf, None
             for image in images:
                 image.set_from_pixbuf(pixbuf)
 
-    def pixbuf_from_user(self, user):
-        # Get the raw image, either from our database or from the Web.
-        id_string = str(user.id)
-        if self.db.has_key(id_string):
-            buffer = self.db[id_string]
-        else:
-            url = user.profile_image_url
-            if not url:
-                return self.empty_pixbuf
-            url8 = url.encode('UTF-8')
+    def download(self, url):
+        # Return the raw image at URL, or None.  Runs within a worker.
+        if not url:
+            return None
+        url8 = url.encode('UTF-8')
+        try:
+            response = Transport.transport.get(url8)
+        except Transport.Error:
+            response = None
+        if response is None or response.status != 200:
+            try:
+                url1 = url.encode('ISO-8859-1')
+            except UnicodeError:
+                return None
             try:
-                buffer = urllib.urlopen(url8).read()
-            except IOError:
-                try:
-                    url1 = url.encode('ISO-8859-1')
-                except UnicodeError:
-                    return self.empty_pixbuf
-                try:
-                    buffer = urllib.urlopen(url1).read()
-                except IOError:
-                    return self.empty_pixbuf
-            self.db[id_string] = buffer
-        # Transform it into a PIL image.
+                response = Transport.transport.get(url1)
+            except Transport.Error:
+                return None
+            if response.status != 200:
+                return None
+        return response.body
+
+    def image_from_buffer(self, buffer):
+        # Return a square PIL image of image_size from the raw image in
+        # BUFFER, or None.  Runs within a worker.
         try:
             im = Image.open(StringIO.StringIO(buffer))
+            if im.mode != 'RGB':
+                im = im.convert('RGB')
         except IOError:
-            return self.empty_pixbuf
-        if im.mode != 'RGB':
-            im = im.convert('RGB')
+            return None
         # Make it square and resize it, keeping the same center.
         sx, sy = im.size
         if sx > sy:
@@ -413,9 +549,7 @@ class Image_loader:
         elif sy > sx:
             extra = (sy - sx) // 2
             im = im.crop((0, extra, sx, extra + sx))
-        im = im.resize((image_size, image_size), Image.ANTIALIAS)
-        # Transform the result into a pixbuf.
-        return self.pixbuf_from_pil(im)
+        return im.resize((image_size, image_size), Image.ANTIALIAS)
 
     def pixbuf_from_pil(self, im):
         handle = StringIO.StringIO()
@@ -427,7 +561,10 @@ class Image_loader:
         loader.close()
         return pixbuf
 
-image_loader = Image_loader()
+if Common.headless:
+    image_loader = None
+else:
+    image_loader = Image_loader()
 
 ## User services.
 
@@ -441,6 +578,9 @@ class User_loader:
         # Ids for which we would like to get a description.
         self.missing_ids = set()
 
+    # Most ids Twitter accepts within a single user lookup.
+    batch_size = 100
+
     def load(self, id):
         if self.db.has_key(str(id)):
             buffer = self.db[str(id)]
@@ -455,41 +595,64 @@ class User_loader:
             Scheduler.Thread(self.load_missing_ids_thread())
 
     def load_missing_ids_thread(self):
+        attempt = 0
         while self.missing_ids:
-            # Pick any id, but do not remove it yet in case this id would
-            # be requested again by another thread, before we are done.
-            id = self.missing_ids.pop()
-            self.missing_ids.add(id)
-
-            # Try fetching a description.
-            print "Before yield", id
+            # Wait first, so more ids accumulate, and the current tab gets
+            # chosen once the call is about to happen.
             yield True
-            print "After yield", id
+
+            # Pick a batch of ids, but do not remove them yet in case they
+            # would be requested again by another thread, before we are done.
+            ids = self.next_batch()
+
+            # Try fetching descriptions, all at once.  Ids stay missing
+            # after a failure, and get retried after a while, unless
+            # Twitter refused them for good, as when none of them exists.
             try:
-                buffer = Common.twitter.get_user_info(id)
-            except Common.Error:
-                # If we do not get it, just ignore it
-                buffer = None
-            if not buffer:
-                self.missing_ids.remove(id)
+                users = yield Common.twitter.lookup_users(ids)
+            except Common.Error, exception:
+                if not Retry.policy.permanent(exception):
+                    attempt += 1
+                    yield Retry.policy.delay(attempt, exception)
+                    continue
+                users = None
+            attempt = 0
+            if not users:
+                self.missing_ids.difference_update(ids)
                 continue
 
-            # Save the description.
-            self.db[str(id)] = buffer
-
-            # Replace the old strip by a new one wherever appropriate.
-            new = self.load(id)
-            assert new is not None
-            old = User(Twitter.dummy_user(id))
-            for tab in Tab.Tab.registry.itervalues():
-                if isinstance(tab.strip_type, User):
-                    if old in tab.strips:
-                        tab.discard_strips([old])
-                        tab.add_strips([new])
-                        # Check!
-                        tab.refresh()
-
-            # Ok, we are now done for real with this id.
-            self.missing_ids.remove(id)
+            # Save the descriptions, then commit them together.
+            for user in users:
+                self.db[str(user['id'])] = simplejson.dumps(user)
+            if hasattr(self.db, 'sync'):
+                self.db.sync()
+
+            # Making a strip also makes it current for its id, and has tabs
+            # and widgets follow, as from a dummy user to the real one.
+            for user in users:
+                User(twyt.data.User(user))
+
+            # Ok, we are now done for real with these ids.  Those Twitter
+            # did not describe, for suspended users say, are given up.
+            self.missing_ids.difference_update(ids)
+
+    def next_batch(self):
+        # Return up to batch_size missing ids, those of users shown in the
+        # current tab coming first.
+        batch = []
+        tab = Common.gui and Common.gui.current_tab()
+        if tab is not None:
+            for strip in tab.strips:
+                if isinstance(strip, User) and strip.id in self.missing_ids:
+                    batch.append(strip.id)
+                    if len(batch) == self.batch_size:
+                        return batch
+        chosen = set(batch)
+        for id in self.missing_ids:
+            if id not in chosen:
+                batch.append(id)
+                if len(batch) == self.batch_size:
+                    break
+        return batch
 
 user_loader = User_loader()
@@ -22,9 +22,12 @@ A Twitter reader and personal manager - Tab structures.
 """
 
 __metaclass__ = type
-import atexit, gtk, re, sys
+import atexit, heapq, re, sys
 
-import Common, Scheduler, Strip
+import Common, Planner, Scheduler, Source, Strip
+
+if not Common.headless:
+    import gtk
 
 class Error(Common.Error):
     pass
@@ -43,6 +46,14 @@ class Tab:
     selected = False
 
     def __init__(self, *inputs):
+        # Within a single epoch, the tab only gets computed once.
+        propagation.start()
+        try:
+            self.initialize(inputs)
+        finally:
+            propagation.end()
+
+    def initialize(self, inputs):
         Tab.ordinal += 1
         self.ordinal = Tab.ordinal
         Tab.registry[self.ordinal] = self
@@ -58,7 +69,6 @@ class Tab:
         for input in inputs:
             self.add_input(input)
         self.goto()
-        # Not sure why this is still needed here.
         self.refresh()
 
     def __str__(self):
@@ -92,14 +102,24 @@ class Tab:
         self.update_tab_label()
 
     def close(self):
+        Scheduler.scheduler.cancel_owner(self)
+        Scheduler.scheduler.cancel_owner(self.widget)
         for input in self.inputs:
             input.outputs.discard(self)
         self.inputs = []
-        for output in list(self.outputs):
-            self.discard_output(output)
+        propagation.start()
+        try:
+            for output in list(self.outputs):
+                self.discard_output(output)
+        finally:
+            propagation.end()
+        propagation.forget(self)
+        release(self, self.strips)
         self.strips = set()
 
     def goto(self):
+        if Common.headless:
+            return
         page = Common.gui.notebook_widget.page_num(self.widget)
         if page >= 0:
             Common.gui.notebook_widget.set_current_page(page)
@@ -133,18 +153,26 @@ class Tab:
             self.update_tab_label()
 
     def hide(self):
-        if not self.hidden:
+        if not self.hidden and Common.headless:
+            self.hidden = True
+        elif not self.hidden:
             page = Common.gui.notebook_widget.page_num(self.widget)
             assert page >= 0, self
             Common.gui.notebook_widget.remove_page(page)
-            self.undisplay_strips(self.strips)
+            # Stop building widgets nobody is going to see.
+            Scheduler.scheduler.cancel_owner(self.widget)
+            self.undisplay_strips(set(self.visible_strip))
             self.hidden = True
 
     def unhide(self):
-        if self.hidden:
+        if self.hidden and Common.headless:
+            self.hidden = False
+        elif self.hidden:
             Common.gui.notebook_widget.append_page(self.widget, gtk.Label())
             Common.gui.notebook_widget.set_tab_reorderable(self.widget, True)
-            self.display_strips(self.strips)
+            Scheduler.scheduler.cancel_owner(self.widget)
+            visible = set(self.visible_strip)
+            self.update_display(self.strips - visible, visible - self.strips)
             self.hidden = False
 
     def add_input(self, tab):
@@ -173,6 +201,10 @@ class Tab:
                 tab.refresh()
 
     def refresh(self):
+        # Have the strips recomputed, once the current epoch gets there.
+        propagation.refresh(self)
+
+    def recompute(self):
         strips = (self.recomputed_strips() | self.added) - self.deleted
         self.discard_strips(self.strips - strips)
         self.add_strips(strips)
@@ -185,52 +217,133 @@ class Tab:
         # Shall be defined in derived classes.
         raise NotImplementedError
 
+    def input_added(self, input, strips):
+        # STRIPS were just added to INPUT.  May be specialised in derived
+        # classes, so to process these in time proportional to their size.
+        self.add_strips(strips)
+
+    def input_discarded(self, input, strips):
+        # STRIPS were just discarded from INPUT.
+        self.discard_strips(strips)
+
     def add_strips(self, strips):
-        strips = self.allowable_strips(strips) - self.strips
-        self.strips |= strips
-        for output in self.outputs:
-            if not output.frozen:
-                output.add_strips(strips)
-        if not self.hidden:
-            self.display_strips(strips)
+        propagation.start()
+        try:
+            strips = self.allowable_strips(strips) - self.strips
+            self.strips |= strips
+            hold(self, strips)
+            propagation.changed(self, strips, ())
+        finally:
+            propagation.end()
         return strips
 
     def discard_strips(self, strips):
-        strips = strips & self.strips
-        self.strips -= strips
-        for output in self.outputs:
-            if not output.frozen:
-                output.discard_strips(strips)
-        if not self.hidden:
-            self.undisplay_strips(strips)
+        propagation.start()
+        try:
+            strips = strips & self.strips
+            self.strips -= strips
+            release(self, strips)
+            propagation.changed(self, (), strips)
+        finally:
+            propagation.end()
         return strips
 
+    def replace_strip(self, old, new):
+        # See replace_strip at module level.
+        if new is not old:
+            for strips in self.strips, self.added, self.deleted:
+                if old in strips:
+                    strips.remove(old)
+                    strips.add(new)
+        if not self.hidden:
+            self.redisplay_strip(old, new)
+
+    # Display threads are owned by the tab widget, so they may be cancelled
+    # independently of other threads working for the tab.  As cancellations
+    # may leave any part of their work undone, these threads only act on
+    # strips still needing it.
+
+    def update_display(self, added, discarded):
+        # A single thread undisplays DISCARDED strips, then displays ADDED.
+        if Common.headless:
+            return
+        Scheduler.Thread(self.update_display_thread(added, discarded), self,
+                         owner=self.widget)
+
+    def update_display_thread(self, added, discarded):
+        if discarded:
+            for value in self.undisplay_strips_thread(discarded):
+                yield value
+        if added:
+            for value in self.display_strips_thread(added):
+                yield value
+
     def display_strips(self, strips):
-        Scheduler.Thread(self.display_strips_thread(strips), self)
+        if Common.headless:
+            return
+        Scheduler.Thread(self.display_strips_thread(strips), self,
+                         owner=self.widget)
 
     def display_strips_thread(self, strips):
-        for counter, strip in enumerate(sorted(strips)):
-            if counter % 10 == 0 and counter:
-                self.update_tab_label()
-                yield 0
+        for strip in sorted(strips, key=Strip.sort_key):
+            if strip in self.visible_strip or strip not in self.strips:
+                continue
             visible_strip = strip.visible_maker(self, strip)
             self.visible_strip[strip] = visible_strip
             self.tab_vbox.pack_start(visible_strip.widget, False, False)
+            if Scheduler.scheduler.slice_exhausted():
+                self.update_tab_label()
+            yield Scheduler.more
         self.update_tab_label()
 
     def undisplay_strips(self, strips):
-        Scheduler.Thread(self.undisplay_strips_thread(strips), self)
+        if Common.headless:
+            return
+        Scheduler.Thread(self.undisplay_strips_thread(strips), self,
+                         owner=self.widget)
 
     def undisplay_strips_thread(self, strips):
-        for counter, strip in enumerate(reversed(sorted(strips))):
-            if counter % 10 == 0 and counter:
-                self.update_tab_label()
-                yield 0
+        for strip in sorted(strips, key=Strip.sort_key, reverse=True):
+            if strip not in self.visible_strip:
+                continue
             self.tab_vbox.remove(self.visible_strip[strip].widget)
             del self.visible_strip[strip]
+            if Scheduler.scheduler.slice_exhausted():
+                self.update_tab_label()
+            yield Scheduler.more
         self.update_tab_label()
 
+    def redisplay_strip(self, old, new):
+        # Have NEW shown instead of OLD, in the same place.
+        if Common.headless:
+            return
+        visible_strip = self.visible_strip.pop(old, None)
+        if new is not old and new in self.visible_strip:
+            # NEW is shown already, so OLD merely goes away.
+            if visible_strip is not None:
+                self.tab_vbox.remove(visible_strip.widget)
+            return
+        if visible_strip is None:
+            # Some display thread has yet to reach OLD, so NEW replaces it
+            # when built, and needs to be displayed if its key changed.
+            if new is not old:
+                self.display_strips(set([new]))
+            return
+        replacement = new.visible_maker(self, new)
+        self.visible_strip[new] = replacement
+        position = self.tab_vbox.child_get_property(visible_strip.widget,
+                                                    'position')
+        self.tab_vbox.remove(visible_strip.widget)
+        self.tab_vbox.pack_start(replacement.widget, False, False)
+        self.tab_vbox.reorder_child(replacement.widget, position)
+        if visible_strip.selected:
+            replacement.select()
+
     def create_widget(self):
+        if Common.headless:
+            # Without GTK, a tab is only a set, with no widget to display it.
+            self.widget = None
+            return
         window = gtk.ScrolledWindow()
         window.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
         vbox = self.tab_vbox = gtk.VBox(False, Common.gui.spacing)
@@ -241,6 +354,8 @@ class Tab:
         self.widget = window
 
     def update_tab_label(self):
+        if Common.headless:
+            return
         text = '<span'
         if self.selected:
             if self.selected == 2:
@@ -260,8 +375,15 @@ class Tab:
                  + '</span>')
         label = gtk.Label()
         label.set_markup(text)
+        description = self.describe()
+        if description:
+            label.set_tooltip_text(description)
         Common.gui.notebook_widget.set_tab_label(self.widget, label)
 
+    def describe(self):
+        # May be defined in derived classes, for a tab label tooltip.
+        return None
+
 class Preset(Tab):
 
     def __init__(self):
@@ -280,58 +402,116 @@ class Preset(Tab):
     def allowable_strips(self, strips):
         return strips & self.preset_strips
 
+    def replace_strip(self, old, new):
+        if new is not old and old in self.preset_strips:
+            self.preset_strips.remove(old)
+            self.preset_strips.add(new)
+        Tab.replace_strip(self, old, new)
+
 class Periodic(Preset):
     period = None
     capacity = 200
+    source_maker = Source.Source
+    # Name of the Twitter service fetching for such tabs.
+    service = None
+    source = None
 
     def __init__(self):
         Preset.__init__(self)
-        Scheduler.Thread(self.periodic_reload_thread())
-
-    def periodic_reload_thread(self):
-        yield 0
-        while True:
-            try:
-                self.reload()
-            except Common.Error:
-                yield 10
-            else:
-                yield self.period
-                yield True
+        self.source = Source.subscribe(self, self.source_maker, self.service)
 
-    def reload(self):
-        # Shall be defined in derived classes.
-        raise NotImplementedError
+    def close(self):
+        self.source.unsubscribe(self)
+        Preset.close(self)
+
+    def describe(self):
+        if self.source is None:
+            return None
+        return Planner.planner.describe(self.source)
+
+    def replace_strip(self, old, new):
+        self.source.replace_strip(old, new)
+        Preset.replace_strip(self, old, new)
 
     def refresh(self):
         if self.capacity is not None:
             if len(self.preset_strips) > self.capacity:
                 self.preset_strips = set(
-                        sorted(self.preset_strips)[-self.capacity:])
+                        sorted(self.preset_strips,
+                               key=Strip.sort_key)[-self.capacity:])
         Preset.refresh(self)
 
-class Union(Tab):
+class Timeline(Periodic):
+    strip_type = Strip.Tweet
+    source_maker = Source.Timeline
+
+class Operation(Tab):
+
+    # A set operation over its input tabs.  COUNTS tells, for each strip,
+    # how many of the counted inputs hold it, so a change within an input
+    # gets processed in time proportional to the change, whatever the
+    # sizes of the sets.  Counts are rebuilt by recomputed_strips, which
+    # refresh calls whenever inputs get added or discarded, and when the
+    # tab gets unfrozen, as a frozen tab does not follow its inputs.
+
+    def count_inputs(self, inputs):
+        self.counts = counts = {}
+        for input in inputs:
+            for strip in input.strips:
+                counts[strip] = counts.get(strip, 0) + 1
+
+    def increment(self, strips):
+        counts = self.counts
+        for strip in strips:
+            counts[strip] = counts.get(strip, 0) + 1
+
+    def decrement(self, strips):
+        counts = self.counts
+        for strip in strips:
+            count = counts[strip] - 1
+            if count:
+                counts[strip] = count
+            else:
+                del counts[strip]
+
+    def replace_count(self, old, new):
+        # See replace_strip at module level.
+        counts = self.counts
+        if old in counts:
+            counts[new] = counts.get(new, 0) + counts.pop(old)
+
+class Union(Operation):
     name_base = 'Union'
 
     def recomputed_strips(self):
-        strips = set()
-        for input in self.inputs:
-            strips |= input.strips
-        return strips
+        self.count_inputs(self.inputs)
+        return set(self.counts)
 
     def allowable_strips(self, strips):
-        unwanted = set(strips)
-        for input in self.inputs:
-            unwanted -= input.strips
-        return strips - unwanted
+        counts = self.counts
+        return set(strip for strip in strips if strip in counts)
+
+    def input_added(self, input, strips):
+        self.increment(strips)
+        self.add_strips(strips)
+
+    def input_discarded(self, input, strips):
+        self.decrement(strips)
+        counts = self.counts
+        self.discard_strips(
+                set(strip for strip in strips if strip not in counts))
 
 class Closeable(Union):
     modified = False
 
     def close(self):
+        self.flush()
+        Union.close(self)
+
+    def flush(self):
         if self.modified:
             self.save_strips()
-        Union.close(self)
+            self.modified = False
 
     def add_strips(self, strips):
         strips = Union.add_strips(self, strips)
@@ -349,9 +529,11 @@ class Closeable(Union):
 
 ## Final types.
 
-class Difference(Tab):
+class Difference(Operation):
     name_base = 'Diff'
 
+    # Only the negative inputs, all but the first, are counted.
+
     def add_output(self, tab):
         negative = set(self.inputs[1:])
         seen = set()
@@ -367,60 +549,65 @@ class Difference(Tab):
         Tab.add_output(self, tab)
 
     def recomputed_strips(self):
-        strips = set()
-        if self.inputs:
-            strips |= self.inputs[0].strips
-            for input in self.inputs[1:]:
-                self.strips -= input.strips
-        return strips
+        self.count_inputs(self.inputs[1:])
+        if not self.inputs:
+            return set()
+        counts = self.counts
+        return set(strip for strip in self.inputs[0].strips
+                   if strip not in counts)
 
     def allowable_strips(self, strips):
-        strips &= self.inputs[0].strips
-        for input in self.inputs[1:]:
-            strips -= input.strips
-        return strips
+        if not self.inputs:
+            return set()
+        positive = self.inputs[0].strips
+        counts = self.counts
+        return set(strip for strip in strips
+                   if strip in positive and strip not in counts)
+
+    def input_added(self, input, strips):
+        if input is self.inputs[0]:
+            self.add_strips(strips)
+        else:
+            self.increment(strips)
+            self.discard_strips(strips)
 
-class Direct_timeline(Periodic):
-    strip_type = Strip.Tweet
+    def input_discarded(self, input, strips):
+        if input is self.inputs[0]:
+            self.discard_strips(strips)
+        else:
+            self.decrement(strips)
+            self.add_strips(strips)
+
+class Direct_timeline(Timeline):
     name_base = 'Direct'
     period = 3 * 60
+    service = 'load_direct_timeline'
 
-    def reload(self):
-        return Common.twitter.load_direct_timeline(self)
-
-class Direct_sent_timeline(Periodic):
-    strip_type = Strip.Tweet
+class Direct_sent_timeline(Timeline):
     name_base = 'DSent'
     period = 60 * 60
-
-    def reload(self):
-        return Common.twitter.load_direct_sent_timeline(self)
+    service = 'load_direct_sent_timeline'
 
 class Followers(Periodic):
     strip_type = Strip.User
+    source_maker = Source.Graph
     name_base = '…ers'
     capacity = None
     period = 60 * 60
-
-    def reload(self):
-        return Common.twitter.fetch_followers(self)
+    service = 'fetch_followers'
 
 class Following(Periodic):
     strip_type = Strip.User
+    source_maker = Source.Graph
     name_base = '…ing'
     capacity = None
     period = 60 * 60
+    service = 'fetch_following'
 
-    def reload(self):
-        return Common.twitter.fetch_following(self)
-
-class Friends_timeline(Periodic):
-    strip_type = Strip.Tweet
+class Friends_timeline(Timeline):
     name_base = 'Friends'
     period = 10 * 60
-
-    def reload(self):
-        return Common.twitter.load_friends_timeline(self)
+    service = 'load_friends_timeline'
 
 class Id_input(Preset):
 
@@ -447,7 +634,7 @@ class Id_output(Closeable):
 
     def save_strips(self):
         write = file(self.file_name, 'w').write
-        for strip in sorted(self.strips):
+        for strip in sorted(self.strips, key=Strip.sort_key):
             write(str(strip) + '\n')
 
 class Interactive(Tab):
@@ -462,46 +649,232 @@ class Interactive(Tab):
     def allowable_strips(self, strips):
         return strips & self.preset_strips
 
-class Intersection(Tab):
+    def replace_strip(self, old, new):
+        if new is not old and old in self.preset_strips:
+            self.preset_strips.remove(old)
+            self.preset_strips.add(new)
+        Tab.replace_strip(self, old, new)
+
+class Intersection(Operation):
     name_base = 'Inter'
 
     def recomputed_strips(self):
-        strips = set()
-        if self.inputs:
-            strips |= self.inputs[0].strips
-            for input in self.inputs[1:]:
-                strips &= input.strips
-        return strips
+        self.count_inputs(self.inputs)
+        wanted = len(self.inputs)
+        return set(strip for strip, count in self.counts.iteritems()
+                   if count == wanted)
 
     def allowable_strips(self, strips):
-        for input in self.inputs:
-            strips &= input.strips
-        return strips
+        counts = self.counts
+        wanted = len(self.inputs)
+        return set(strip for strip in strips if counts.get(strip) == wanted)
+
+    def input_added(self, input, strips):
+        self.increment(strips)
+        self.add_strips(strips)
+
+    def input_discarded(self, input, strips):
+        # A strip an input lost is no longer within all inputs.
+        self.decrement(strips)
+        self.discard_strips(strips)
 
 class Public_timeline(Periodic):
     strip_type = Strip.Tweet
     name_base = 'Public'
     period = 2 * 60
+    service = 'load_public_timeline'
 
-    def reload(self):
-        return Common.twitter.load_public_timeline(self)
-
-class Replies_timeline(Periodic):
-    strip_type = Strip.Tweet
+class Replies_timeline(Timeline):
     name_base = 'Replies'
     period = 2 * 60
+    service = 'load_replies_timeline'
 
-    def reload(self):
-        return Common.twitter.load_replies_timeline(self)
-
-class User_timeline(Periodic):
-    strip_type = Strip.Tweet
+class User_timeline(Timeline):
     period = 4 * 60
+    service = 'load_user_timeline'
 
     def __init__(self):
         import Twitter
         self.name_base = Twitter.user.capitalize()
-        Periodic.__init__(self)
+        Timeline.__init__(self)
+
+## Propagation.
+
+class Propagation:
+
+    # Changes to tabs get propagated in epochs.  An epoch starts with the
+    # outermost change, and while it lasts, changes only get noted.  Once
+    # that outermost change is over, the tabs it affected are processed in
+    # topological order, inputs before outputs, each of them once.  A tab
+    # to refresh gets recomputed from its inputs; any other tab gets the
+    # net changes of its inputs.  So with diamonds in the tab graph, a tab
+    # is not computed again for each path reaching it.  Finally, each tab
+    # having changed gets a single display update, for its net change.
 
-    def reload(self):
-        return Common.twitter.load_user_timeline(self)
+    def __init__(self):
+        # Nesting level of changes, 0 outside epochs.
+        self.depth = 0
+        # From tab to its net [added, discarded] strips within the epoch.
+        self.changes = {}
+        # From tab to the net changes of its inputs it has yet to process,
+        # each given as a dictionary from input to [added, discarded].
+        self.pending = {}
+        # Tabs needing to be recomputed.
+        self.stale = set()
+        # Heap of (rank, ordinal, tab) for tabs awaiting processing, and
+        # the set of these tabs.
+        self.queue = []
+        self.queued = set()
+
+    def start(self):
+        self.depth += 1
+
+    def end(self):
+        if self.depth > 1:
+            self.depth -= 1
+            return
+        try:
+            self.propagate()
+        finally:
+            self.depth = 0
+            self.changes = {}
+            self.pending = {}
+            self.stale = set()
+            self.queue = []
+            self.queued = set()
+
+    def refresh(self, tab):
+        self.start()
+        try:
+            self.stale.add(tab)
+            self.enqueue(tab)
+        finally:
+            self.end()
+
+    def changed(self, tab, added, discarded):
+        # Note that ADDED strips went into TAB, and DISCARDED strips left it.
+        if not added and not discarded:
+            return
+        merge(self.changes, tab, added, discarded)
+        for output in tab.outputs:
+            if not output.frozen:
+                merge(self.pending.setdefault(output, {}), tab,
+                      added, discarded)
+                self.enqueue(output)
+
+    def forget(self, tab):
+        # TAB is being closed, so leave it alone.
+        self.changes.pop(tab, None)
+        self.pending.pop(tab, None)
+        self.stale.discard(tab)
+
+    def enqueue(self, tab):
+        if tab not in self.queued:
+            self.queued.add(tab)
+            heapq.heappush(self.queue, (self.rank(tab, {}), tab.ordinal, tab))
+
+    def rank(self, tab, ranks):
+        # A tab ranks after all its inputs, loops aside.  RANKS caches the
+        # ranks computed so far.  As inputs may change between two calls,
+        # the cache does not outlive a call.
+        rank = ranks.get(tab)
+        if rank is None:
+            rank = ranks[tab] = 0
+            for input in tab.inputs:
+                rank = max(rank, self.rank(input, ranks) + 1)
+            ranks[tab] = rank
+        return rank
+
+    def propagate(self):
+        while self.queue:
+            rank, ordinal, tab = heapq.heappop(self.queue)
+            self.queued.discard(tab)
+            pending = self.pending.pop(tab, {})
+            if tab in self.stale:
+                self.stale.discard(tab)
+                tab.recompute()
+                continue
+            for input, (added, discarded) in pending.iteritems():
+                if discarded:
+                    tab.input_discarded(input, discarded)
+                if added:
+                    tab.input_added(input, added)
+        for tab, (added, discarded) in self.changes.iteritems():
+            if not tab.hidden and (added or discarded):
+                tab.update_display(added, discarded)
+
+def merge(changes, key, added, discarded):
+    # Merge ADDED and DISCARDED strips into the net change for KEY, within
+    # CHANGES.  A strip added then discarded, or the other way around, is
+    # back where it was, so it is no longer part of the net change.
+    change = changes.get(key)
+    if change is None:
+        change = changes[key] = [set(), set()]
+    if added:
+        back = change[1] & added
+        change[1] -= back
+        change[0] |= added - back
+    if discarded:
+        back = change[0] & discarded
+        change[0] -= back
+        change[1] |= discarded - back
+
+propagation = Propagation()
+
+## Strip updates.
+
+# From strip to the set of tabs holding it.  Tabs keep this up to date as
+# their strips change, so when a strip gets new contents, or gets replaced
+# by another, only the tabs holding it are updated, without recomputing
+# any set, and within these, only the widget showing it gets rebuilt.
+holders = {}
+
+def hold(tab, strips):
+    for strip in strips:
+        tabs = holders.get(strip)
+        if tabs is None:
+            tabs = holders[strip] = set()
+        tabs.add(tab)
+
+def release(tab, strips):
+    for strip in strips:
+        tabs = holders.get(strip)
+        if tabs is not None:
+            tabs.discard(tab)
+            if not tabs:
+                del holders[strip]
+
+def replace_strip(old, new):
+    # NEW holds the latest contents for OLD.  It is either OLD itself,
+    # refreshed in place, or another strip for the same thing, whose key
+    # changed, like a renamed user, or a user now described.
+    tabs = holders.get(old)
+    if not tabs:
+        return
+    merging = new is not old and new in holders
+    if new is not old:
+        del holders[old]
+        holders.setdefault(new, set()).update(tabs)
+        # Operations also count strips they do not hold, as those within
+        # negative inputs, or within only some inputs.  Any operation
+        # counting OLD is an output of some tab holding it.
+        operations = set()
+        for tab in tabs:
+            operations |= tab.outputs
+            operations.add(tab)
+        for operation in operations:
+            if isinstance(operation, Operation):
+                operation.replace_count(old, new)
+    for tab in list(tabs):
+        tab.replace_strip(old, new)
+    if merging:
+        # NEW was held already, so some tab may have held both, or some
+        # operation may now get NEW from inputs which disagreed before.
+        # Such merges being rare, operations simply get recomputed.
+        propagation.start()
+        try:
+            for operation in operations:
+                if isinstance(operation, Operation) and not operation.frozen:
+                    operation.refresh()
+        finally:
+            propagation.end()
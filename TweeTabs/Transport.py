@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+"""\
+A Twitter reader and personal manager - HTTP transport.
+"""
+
+__metaclass__ = type
+import httplib, socket, threading, urlparse, zlib
+
+import Common
+
+class Error(Common.Error):
+    pass
+
+class Response:
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        # Header names are lower case.
+        self.headers = headers
+        self.body = body
+
+class Transport:
+
+    # All network traffic goes through here.  Connections are kept alive
+    # after use, in a small pool per host, so later requests to the same
+    # host save the connection setup.  Bodies are asked compressed, and
+    # decompressed on arrival.  This is called from executor workers, so
+    # pools are protected by a lock, and every connection is used by a
+    # single request at a time.
+
+    # Idle connections kept per host.
+    pool_size = 4
+    connect_timeout = 10
+    read_timeout = 30
+    max_redirects = 5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # From (scheme, host) to a list of idle connections.
+        self.pools = {}
+
+    def get(self, url, headers={}):
+        # Return a Response for URL, following redirections.
+        for counter in range(self.max_redirects):
+            response = self.request('GET', url, None, headers)
+            if (response.status not in (301, 302, 303, 307)
+                    or 'location' not in response.headers):
+                return response
+            url = urlparse.urljoin(url, response.headers['location'])
+        raise Error("Too many redirections for " + url)
+
+    def request(self, method, url, body=None, headers={}):
+        # Return a Response for METHOD on URL, sending BODY if not None.
+        scheme, host, path, query, fragment = urlparse.urlsplit(url)
+        if scheme not in ('http', 'https'):
+            raise Error("Unsupported URL " + url)
+        selector = path or '/'
+        if query:
+            selector += '?' + query
+        headers = dict(headers)
+        headers.setdefault('User-Agent', 'TweeTabs')
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        # An idle connection may have been closed by the server meanwhile.
+        # If so, a request which may safely be repeated is repeated, over
+        # another connection, and ultimately over a new one.
+        while True:
+            connection, reused = self.checkout(scheme, host)
+            try:
+                connection.request(method, selector, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error), exception:
+                connection.close()
+                if reused and method in ('GET', 'HEAD'):
+                    continue
+                raise Error("%s: %s" % (url, exception))
+            break
+        if response.will_close:
+            connection.close()
+        else:
+            self.checkin(scheme, host, connection)
+        headers = dict((name.lower(), value)
+                       for name, value in response.getheaders())
+        try:
+            data = decoded(data, headers.get('content-encoding'))
+        except zlib.error, exception:
+            raise Error("%s: %s" % (url, exception))
+        return Response(response.status, response.reason, headers, data)
+
+    def checkout(self, scheme, host):
+        # Return an idle connection to HOST, or a new one, and a flag
+        # telling if it was reused.
+        self.lock.acquire()
+        try:
+            pool = self.pools.get((scheme, host))
+            if pool:
+                return pool.pop(), True
+        finally:
+            self.lock.release()
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(host,
+                                                 timeout=self.connect_timeout)
+        else:
+            connection = httplib.HTTPConnection(host,
+                                                timeout=self.connect_timeout)
+        try:
+            connection.connect()
+        except socket.error, exception:
+            raise Error("%s: %s" % (host, exception))
+        connection.sock.settimeout(self.read_timeout)
+        # Requests are small and sent whole, so do not let them linger.
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection, False
+
+    def checkin(self, scheme, host, connection):
+        self.lock.acquire()
+        try:
+            pool = self.pools.setdefault((scheme, host), [])
+            if len(pool) < self.pool_size:
+                pool.append(connection)
+                return
+        finally:
+            self.lock.release()
+        connection.close()
+
+def decoded(data, encoding):
+    # Undo the content ENCODING of DATA.
+    if encoding == 'gzip':
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        # Servers disagree on whether deflate comes with a zlib header.
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
+
+transport = Transport()
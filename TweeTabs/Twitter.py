@@ -22,53 +22,196 @@ A Twitter reader and personal manager - Twitter API management.
 """
 
 __metaclass__ = type
-import simplejson
+import base64, simplejson, sys, time, urllib
 import twyt.twitter, twyt.data
 
-import Common, Scheduler, Strip
+import Common, Retry, Scheduler, Strip, Transport
 
 class Error(Common.Error):
-    pass
+    # ENDPOINT is the failing API path, STATUS the HTTP status of the
+    # response, and RETRY_AFTER the seconds Twitter asked to wait, when
+    # known.
+    endpoint = None
+    status = None
+    retry_after = None
 
-twytter = twyt.twitter.Twitter()
+class Api_error(twyt.twitter.TwitterException):
+
+    def __init__(self, message, status, retry_after):
+        twyt.twitter.TwitterException.__init__(self, message)
+        self.status = status
+        self.retry_after = retry_after
 
 # Set these from your ~/.tweetabs/defaults.py file, rather than here.
 user = None
 password = None
 
+api_url = 'http://twitter.com/'
+
+def api_call(method, path, authenticate=True, **arguments):
+    # Call the Twitter API method at PATH, and return the JSON text of the
+    # response.  This runs within executor workers, and goes through the
+    # shared transport.  twyt is only used for its data structures.
+    url = api_url + path + '.json'
+    for name, value in arguments.items():
+        if isinstance(value, unicode):
+            arguments[name] = value.encode('UTF-8')
+    query = urllib.urlencode(arguments)
+    headers = {}
+    if authenticate:
+        headers['Authorization'] = (
+                'Basic ' + base64.b64encode(user + ':' + password))
+    if method == 'POST':
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        body = query
+    else:
+        if query:
+            url += '?' + query
+        body = None
+    try:
+        response = Transport.transport.request(method, url, body, headers)
+    except Transport.Error, exception:
+        raise twyt.twitter.TwitterException(str(exception))
+    note_rate_limit(response, authenticate)
+    if response.status >= 400:
+        raise Api_error('HTTP %d %s' % (response.status, response.reason),
+                        response.status, retry_after(response))
+    return response.body
+
+def api_get(path, **arguments):
+    return Retry.policy.call(path, api_call, 'GET', path, **arguments)
+
+def api_post(path, **arguments):
+    return Retry.policy.call(path, api_call, 'POST', path, **arguments)
+
+def retry_after(response):
+    # Return the seconds a failed RESPONSE asks to wait, None if unknown.
+    try:
+        return int(response.headers['retry-after'])
+    except (KeyError, ValueError):
+        pass
+    if response.headers.get('x-ratelimit-remaining') == '0':
+        try:
+            reset = float(response.headers['x-ratelimit-reset'])
+        except (KeyError, ValueError):
+            return None
+        return max(0, reset - time.time())
+
+def note_rate_limit(response, authenticate):
+    # Twitter tells the state of the budget a request was charged to,
+    # within the headers of each response, failed ones included.  This
+    # runs within executor workers, so the news is passed to the main loop.
+    try:
+        remaining = int(response.headers['x-ratelimit-remaining'])
+        limit = int(response.headers['x-ratelimit-limit'])
+        reset = float(response.headers['x-ratelimit-reset'])
+    except (KeyError, ValueError):
+        return
+    if authenticate:
+        name = 'auth'
+    else:
+        name = 'ip'
+    Scheduler.scheduler.backend.call_soon(
+            Common.twitter.set_budget, name, remaining, limit, reset)
+
+# Decoding a response which is not what Twitter documents, even if it
+# came with a 200 status, raises one of these.
+decode_errors = ValueError, KeyError, TypeError
+
+def get_json(path, **arguments):
+    # Return the decoded JSON response of the API method at PATH.  As this
+    # runs within an executor worker, decoding does not stall the main loop.
+    return simplejson.loads(api_get(path, **arguments))
+
+def get_id_page(path, cursor):
+    # Return the ids within the page at CURSOR of the id list at PATH, and
+    # the cursor for the next page, 0 if none.  Pages hold at most 5000
+    # ids, so they stay small.
+    page = get_json(path, cursor=cursor)
+    return page['ids'], page['next_cursor']
+
 class twytcall:
 
+    # Decorate a Twitter service.  The service returns a future, usually
+    # obtained through Twitter.submit, so the network work gets done by
+    # some executor worker, while anything chained through Future.then
+    # gets done within the main loop.  While the future is pending, a
+    # message tells what is going on.  If the future fails because of
+    # Twitter, this gets reported, and the decorated service returns a
+    # future failing with an Error instead.  So does a malformed response,
+    # failing to decode.  Calls refused by the retry policy fail the same
+    # way, yet quietly, as their endpoint already reported enough.
+
     def __init__(this, message):
         this.message = message
 
     def __call__(this, func):
 
         def decorated(self, *args, **kws):
-            self.message(this.message + '…')
+            self.start_message(this.message + '…')
+            future = Scheduler.Future()
+
+            def completed(inner):
+                self.end_message(this.message + '…')
+                if (inner.exc_info is not None
+                        and issubclass(inner.exc_info[0],
+                                       (twyt.twitter.TwitterException,
+                                        Retry.Unavailable)
+                                       + decode_errors)):
+                    exception = inner.exc_info[1]
+                    if isinstance(exception, decode_errors):
+                        diagnostic = 'Malformed response, ' + this.message
+                    else:
+                        diagnostic = str(exception) + ', ' + this.message
+                    if not isinstance(exception, Retry.Unavailable):
+                        self.error(diagnostic)
+                    error = Error(diagnostic)
+                    error.endpoint = getattr(exception, 'endpoint', None)
+                    error.status = getattr(exception, 'status', None)
+                    error.retry_after = getattr(exception, 'retry_after',
+                                                None)
+                    try:
+                        raise error
+                    except Error:
+                        future.complete(exc_info=sys.exc_info())
+                else:
+                    future.complete(inner.result, inner.exc_info)
+
             try:
-                return func(self, *args, **kws)
-            except twyt.twitter.TwitterException, exception:
-                diagnostic = str(exception) + ', ' + this.message
-                self.error(diagnostic)
-                raise Error(diagnostic)
-            finally:
-                self.message('')
+                inner = func(self, *args, **kws)
+            except:
+                inner = Scheduler.Future()
+                inner.complete(exc_info=sys.exc_info())
+            inner.add_callback(completed)
+            return future
 
         return decorated
 
 class Twitter:
-    auth_limit = 50
-    ip_limit = 50
 
     def __init__(self):
-        twytter.set_user_agent("TweeTabs")
-        twytter.set_auth(user, password)
         self.error_list = []
+        # Messages for the services in progress, the latest being shown.
+        self.messages = []
+
+    def submit(self, func, *args, **kws):
+        # Have FUNC(*ARGS, **KWS) called by an executor worker.
+        return Scheduler.scheduler.executor.submit(func, *args, **kws)
+
+    def start_message(self, message):
+        self.messages.append(message)
+        self.message(message)
+
+    def end_message(self, message):
+        self.messages.remove(message)
+        if self.messages:
+            self.message(self.messages[-1])
+        else:
+            self.message('')
 
-    def start(self):
-        pass
-    
     def message(self, message=None):
+        if Common.headless:
+            return
         if message:
             Common.gui.twitter_message_widget.set_markup(
                     '<span size="small">' + Common.escape(message) + '</span>')
@@ -77,6 +220,12 @@ class Twitter:
         Common.gui.refresh()
 
     def error(self, diagnostic):
+        if Common.headless:
+            sys.stderr.write(diagnostic + '\n')
+            return
+        # Many threads failing alike should not flood the error widget.
+        if diagnostic in self.error_list:
+            return
         self.error_list.append(diagnostic)
         if len(self.error_list) == 1:
             Scheduler.Thread(self.error_thread())
@@ -96,89 +245,112 @@ class Twitter:
 
     @twytcall("getting Auth limit")
     def get_auth_limit(self):
-        response = twyt.data.RateLimit(twytter.account_rate_limit_status(True))
-        self.auth_limit = response['remaining_hits']
-        self.display_limits()
+        return self.submit(api_get, 'account/rate_limit_status').then(
+                self.update_budget, 'auth')
 
     @twytcall("getting IP limit")
     def get_ip_limit(self):
-        response = twyt.data.RateLimit(twytter.account_rate_limit_status(False))
-        self.ip_limit = response['remaining_hits']
-        self.display_limits()
+        return self.submit(api_get, 'account/rate_limit_status',
+                           authenticate=False).then(
+                self.update_budget, 'ip')
 
     @twytcall("fetching followers")
-    def fetch_followers(self, tab):
-        tab.preset_strips = user_strips_from_json(
-                twytter.social_graph_followers_ids())
-        tab.refresh()
+    def fetch_followers(self, source):
+        return self.submit(get_id_page, 'followers/ids', source.cursor).then(
+                self.add_users, source)
 
     @twytcall("fetching following")
-    def fetch_following(self, tab):
-        tab.preset_strips = user_strips_from_json(
-            twytter.social_graph_friends_ids())
-        tab.refresh()
+    def fetch_following(self, source):
+        return self.submit(get_id_page, 'friends/ids', source.cursor).then(
+                self.add_users, source)
 
-    @twytcall("getting user info")
-    def get_user_info(self, id):
-        print "Getting", repr(id), "info"
-        return twytter.user_show(id)
+    @twytcall("looking up users")
+    def lookup_users(self, ids):
+        return self.submit(get_json, 'users/lookup',
+                           user_id=','.join(map(str, ids)))
 
     @twytcall("loading direct timeline")
-    def load_direct_timeline(self, tab):
-        tab.preset_strips |= set(map(
-            Strip.Tweet,
-            twyt.data.StatusList(twytter.direct_messages())))
-        tab.refresh()
+    def load_direct_timeline(self, source):
+        return self.submit(api_get, 'direct_messages',
+                           **source.paging()).then(self.add_page, source)
 
     @twytcall("loading direct sent timeline")
-    def load_direct_sent_timeline(self, tab):
-        tab.preset_strips |= set(map(
-            Strip.Tweet, twyt.data.StatusList(twytter.direct_sent())))
-        tab.refresh()
+    def load_direct_sent_timeline(self, source):
+        return self.submit(api_get, 'direct_messages/sent',
+                           **source.paging()).then(self.add_page, source)
 
     @twytcall("loading friends timeline")
-    def load_friends_timeline(self, tab):
-        tab.preset_strips |= set(map(
-            Strip.Tweet,
-            twyt.data.StatusList(twytter.status_friends_timeline())))
-        tab.refresh()
+    def load_friends_timeline(self, source):
+        return self.submit(api_get, 'statuses/friends_timeline',
+                           **source.paging()).then(self.add_page, source)
 
     @twytcall("loading public timeline")
-    def load_public_timeline(self, tab):
-        tab.preset_strips |= set(map(
-            Strip.Tweet,
-            twyt.data.StatusList(twytter.status_public_timeline())))
-        tab.refresh()
+    def load_public_timeline(self, source):
+        return self.submit(api_get, 'statuses/public_timeline').then(
+                self.add_statuses, source)
 
     @twytcall("loading replies timeline")
-    def load_replies_timeline(self, tab):
-        tab.preset_strips |= set(map(
-            Strip.Tweet,
-            twyt.data.StatusList(twytter.status_replies())))
-        tab.refresh()
+    def load_replies_timeline(self, source):
+        return self.submit(api_get, 'statuses/replies',
+                           **source.paging()).then(self.add_page, source)
 
     @twytcall("loading user timeline")
-    def load_user_timeline(self, tab):
-        tab.preset_strips |= set(map(
-            Strip.Tweet,
-            twyt.data.StatusList(twytter.status_user_timeline())))
-        tab.refresh()
+    def load_user_timeline(self, source):
+        return self.submit(api_get, 'statuses/user_timeline',
+                           **source.paging()).then(self.add_page, source)
+
+    @twytcall("checking sent tweets")
+    def get_own_statuses(self):
+        return self.submit(api_get, 'statuses/user_timeline').then(
+                twyt.data.StatusList)
 
     @twytcall("sending tweet")
     def send_tweet(self, message):
-        twytter.status_update(message)
+        return self.submit(api_post, 'statuses/update', status=message)
 
     ## Services.
 
+    def add_statuses(self, json, source):
+        source.add_strips(set(map(Strip.Tweet, twyt.data.StatusList(json))))
+
+    def add_page(self, json, source):
+        # Return True if SOURCE needs the next older page.
+        statuses = twyt.data.StatusList(json)
+        source.add_strips(set(map(Strip.Tweet, statuses)))
+        return source.page_added(statuses)
+
+    def add_users(self, page, source):
+        # Return True if SOURCE needs the next page.
+        ids, source.cursor = page
+        return source.page_added(user_strips(ids))
+
+    def update_budget(self, json, name):
+        response = twyt.data.RateLimit(json)
+        self.set_budget(name, response['remaining_hits'],
+                        response['hourly_limit'],
+                        response['reset_time_in_seconds'])
+
+    def set_budget(self, name, remaining, limit, reset):
+        Scheduler.scheduler.update_budget(name, remaining, limit, reset)
+        self.display_limits()
+
     def display_limits(self):
+        if Common.headless:
+            return
+        limiter = Scheduler.scheduler.limiter
         Common.gui.twitter_limits_widget.set_markup(
                 '<span  size="small" foreground="gray50">%s/%s</span>'
-                 % (self.auth_limit, self.ip_limit))
+                 % (limiter['auth'].remaining, limiter['ip'].remaining))
         Common.gui.refresh()
 
-def user_strips_from_json(json):
-    return set(Strip.User(Strip.user_loader.load(id) or dummy_user(id))
-               for id in simplejson.loads(json))
+def user_strips(ids):
+    strips = set()
+    for id in ids:
+        strip = Strip.users_by_id.get(id)
+        if strip is None:
+            strip = Strip.User(Strip.user_loader.load(id) or dummy_user(id))
+        strips.add(strip)
+    return strips
 
 def dummy_user(id):
     return twyt.data.User({
@@ -190,30 +362,3 @@ def dummy_user(id):
         'profile_image_url': None,
         'url': None,
         'protected': False})
-
-if Common.threaded:
-
-    import Queue, threading
-
-    class Threaded_Twitter(threading.Thread, Twitter):
-        quit_flag = False
-
-        def __init__(self):
-            threading.Thread.__init__(self, name="Twitter manager")
-            self.queue = Queue.Queue()
-            Twitter.__init__(self)
-
-        def run(self):
-            while not self.quit_flag:
-                try:
-                    func, args, kws = self.queue.get(timeout=delay)
-                    func(*args, **kws)
-                    self.queue.task_done()
-                except Queue.Empty:
-                    pass
-
-        def enqueue(self, func, *args, **kws):
-            self.queue.put((func, args, kws))
-
-        def quit(self):
-            self.quit_flag = True
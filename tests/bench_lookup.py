@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+
+"""\
+Measure user hydration through batched lookups, against one id per call.
+
+Usage: python tests/bench_lookup.py [IDS]
+
+IDS user ids get described by the user loader, from a mock Twitter
+served locally over HTTP, first one id per call, as it formerly went,
+then in batches of User_loader.batch_size.  The rate limiter is given
+a budget large enough not to get in the way.  For each run, the report
+gives the API calls, the wall time, and the hours these calls would
+take within the usual budget of 150 calls per hour.
+"""
+
+__metaclass__ = type
+import BaseHTTPServer, os, shutil, sys, tempfile, threading, time, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from TweeTabs import Common
+Common.headless = True
+Common.configdir = tempfile.mkdtemp()
+from TweeTabs import Scheduler, Tab, Strip, Twitter
+import simplejson
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Serve users/lookup, describing all requested ids.
+
+    calls = 0
+
+    def do_GET(self):
+        Handler.calls += 1
+        url = urlparse.urlparse(self.path)
+        if url.path != '/users/lookup.json':
+            self.send_error(404)
+            return
+        query = urlparse.parse_qs(url.query)
+        ids = map(int, query['user_id'][0].split(','))
+        body = simplejson.dumps([{'id': id, 'screen_name': 'user%d' % id,
+                                  'name': 'User %d' % id}
+                                 for id in ids])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *arguments):
+        pass
+
+def done_thread(loader):
+    while loader.missing_ids:
+        yield 0.01
+    Scheduler.scheduler.backend.quit()
+
+def hydrate(ids, batch_size, write):
+    # Start from an empty user cache.
+    configdir = Common.configdir = tempfile.mkdtemp()
+    loader = Strip.user_loader = Strip.User_loader()
+    loader.batch_size = batch_size
+    scheduler = Scheduler.scheduler
+    now = time.time()
+    scheduler.update_budget('auth', 10 ** 9, 10 ** 9, now + 3600)
+    scheduler.limiter['auth'].burst = 10 ** 9
+    Handler.calls = 0
+    start = time.time()
+    for id in range(1, ids + 1):
+        loader.load(id)
+    Scheduler.Thread(done_thread(loader))
+    scheduler.backend.run()
+    elapsed = time.time() - start
+    described = len(loader.db.keys())
+    loader.db.close()
+    shutil.rmtree(configdir)
+    write("%-10d %7d %9d %8.2f %8.1f\n"
+          % (batch_size, Handler.calls, described, elapsed,
+             Handler.calls / 150.0))
+
+def main(*arguments):
+    ids = 10000
+    if arguments:
+        ids = int(arguments[0])
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    worker = threading.Thread(target=server.serve_forever)
+    worker.setDaemon(True)
+    worker.start()
+    Twitter.api_url = 'http://127.0.0.1:%d/' % server.server_port
+    Twitter.user = Twitter.password = 'bench'
+    Scheduler.scheduler.backend = Scheduler.Realtime_backend()
+    Scheduler.scheduler.executor.start()
+    Common.twitter = Twitter.Twitter()
+    write = sys.stdout.write
+    write("%d ids\n" % ids)
+    write("%-10s %7s %9s %8s %8s\n"
+          % ('Batch', 'Calls', 'Described', 'Seconds', 'Hours'))
+    hydrate(ids, 1, write)
+    hydrate(ids, Strip.User_loader.batch_size, write)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+
+"""\
+Compare scheduler timeouts with the former heap-plus-re-arm approach.
+
+Usage: python tests/bench_scheduler.py [THREADS [DELAYS]]
+
+THREADS threads each sleep DELAYS times for random delays up to 50 ms,
+in real time, first with the current scheduler, then with one re-arming
+its timeout at each delay, as the scheduler formerly did.  For each, the
+report gives the timeout sources created, the wakeups per second, and
+the jitter: how late threads resume after their wanted time.  A last
+run measures threads continuing after their time slice, through
+Scheduler.more, against the same work done in a row.
+"""
+
+__metaclass__ = type
+import heapq, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from TweeTabs import Scheduler
+
+class Counting_backend(Scheduler.Realtime_backend):
+
+    def __init__(self):
+        Scheduler.Realtime_backend.__init__(self)
+        self.created = 0
+        self.removed_count = 0
+        self.wakeups = 0
+
+    def timeout_add(self, interval, func):
+        self.created += 1
+
+        def counted():
+            self.wakeups += 1
+            return func()
+
+        return Scheduler.Realtime_backend.timeout_add(self, interval, counted)
+
+    def source_remove(self, id):
+        self.removed_count += 1
+        Scheduler.Realtime_backend.source_remove(self, id)
+
+class Rearming_scheduler(Scheduler.Scheduler):
+
+    # The former approach: each delay removes and re-creates the timeout,
+    # with a 10 ms floor, and the delay loop always re-arms, every 5
+    # seconds when idle.
+
+    def delay(self, delta, thread):
+        now = self.now()
+        thread.start_wait('delay')
+        heapq.heappush(self.delayed_threads, (now + delta, thread))
+        if not self.within_delay_loop:
+            if self.timeout_id is not None:
+                self.backend.source_remove(self.timeout_id)
+            self.timeout_id = self.backend.timeout_add(
+                    self.floored(now), self.delay_loop)
+
+    def delay_loop(self):
+        self.within_delay_loop = True
+        now = self.now()
+        while self.delayed_threads and now >= self.delayed_threads[0][0]:
+            future, thread = heapq.heappop(self.delayed_threads)
+            thread.advance()
+            now = self.now()
+        self.timeout_id = self.backend.timeout_add(self.floored(now),
+                                                   self.delay_loop)
+        self.within_delay_loop = False
+        return False
+
+    def floored(self, now):
+        if self.delayed_threads:
+            return max(10, int(1000 * (self.delayed_threads[0][0] - now)))
+        return 5000
+
+def sleeper_thread(delays, jitters, generator, remaining):
+    for counter in range(delays):
+        delta = generator.uniform(0, 0.05)
+        wanted = time.time() + delta
+        yield delta
+        jitters.append(time.time() - wanted)
+    # The last thread to finish stops the run.
+    remaining[0] -= 1
+    if not remaining[0]:
+        Scheduler.scheduler.backend.quit()
+
+def sleepers(maker, threads, delays, write):
+    backend = Counting_backend()
+    Scheduler.scheduler = maker()
+    Scheduler.scheduler.backend = backend
+    Scheduler.scheduler.executor = Scheduler.Executor(0)
+    jitters = []
+    generator = random.Random(0)
+    start = time.time()
+    remaining = [threads]
+    for counter in range(threads):
+        Scheduler.Thread(sleeper_thread(delays, jitters, generator,
+                                        remaining))
+    backend.run()
+    elapsed = time.time() - start
+    jitters.sort()
+    write("%-20s %7d %7d %8.1f %8.2f %8.2f %8.2f\n"
+          % (maker.__name__, backend.created, backend.wakeups,
+             backend.wakeups / elapsed,
+             1000 * sum(jitters) / len(jitters),
+             1000 * jitters[len(jitters) * 99 // 100],
+             1000 * jitters[-1]))
+
+def worker_thread(steps):
+    for counter in range(steps):
+        sum(range(200))
+        yield Scheduler.more
+    if Scheduler.scheduler.backend is not None:
+        Scheduler.scheduler.backend.quit()
+
+def continuations(steps, write):
+    Scheduler.scheduler.backend = None
+    start = time.time()
+    for value in worker_thread(steps):
+        pass
+    alone = time.time() - start
+    backend = Counting_backend()
+    Scheduler.scheduler = Scheduler.Scheduler()
+    Scheduler.scheduler.backend = backend
+    Scheduler.scheduler.executor = Scheduler.Executor(0)
+    start = time.time()
+    Scheduler.Thread(worker_thread(steps))
+    backend.run()
+    elapsed = time.time() - start
+    write("%d steps: %.3f s in a row, %.3f s through the scheduler,"
+          " %d wakeups\n" % (steps, alone, elapsed, backend.wakeups))
+
+def main(*arguments):
+    threads = 200
+    delays = 25
+    if arguments:
+        threads = int(arguments[0])
+    if len(arguments) > 1:
+        delays = int(arguments[1])
+    write = sys.stdout.write
+    write("%d threads, %d delays each\n" % (threads, delays))
+    write("%-20s %7s %7s %8s %8s %8s %8s\n"
+          % ('Scheduler', 'Sources', 'Wakeups', 'Per sec',
+             'Mean ms', '99% ms', 'Max ms'))
+    sleepers(Scheduler.Scheduler, threads, delays, write)
+    sleepers(Rearming_scheduler, threads, delays, write)
+    continuations(20000, write)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+
+"""\
+Compare compact strips with the former ones, keeping whole statuses.
+
+Usage: python tests/bench_strips.py [TWEETS]
+
+TWEETS statuses, from a thousand users, get decoded page by page, as
+fetched, and turned into strips, first the former way, each strip
+keeping its twyt status and comparing through __cmp__, then as current
+Strip.Tweet strips.  Each way runs within its own process, so memory
+does not carry over.  The report gives the memory retained by the
+strips, read from /proc so for Linux only, the time to sort them, and
+the time for a difference and an intersection with half of them.
+"""
+
+__metaclass__ = type
+import gc, os, random, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from TweeTabs import Common
+Common.headless = True
+Common.configdir = tempfile.mkdtemp()
+from TweeTabs import Tab, Strip
+import simplejson, twyt.data
+
+class Former_strip:
+
+    # Strips as they were, with a __dict__, comparing through __cmp__,
+    # and hashing their key each time.
+
+    def __init__(self, key):
+        self.key = key
+
+    def __cmp__(self, other):
+        return cmp(self.key, other.key)
+
+    def __hash__(self):
+        return hash(self.key)
+
+class Former_tweet(Former_strip):
+
+    def __init__(self, status):
+        self.status = status
+        Former_strip.__init__(self, status.id)
+
+def pages(tweets, size=200):
+    # Yield JSON pages of statuses, as Twitter would send them.
+    for start in range(0, tweets, size):
+        statuses = []
+        for id in range(start, min(tweets, start + size)):
+            user = id % 1000
+            statuses.append({
+                    'id': id,
+                    'text': "Tweet number %d, with a few words in it" % id,
+                    'created_at': 'Mon Jun 15 10:00:00 +0000 2009',
+                    'source': 'web', 'truncated': False, 'favorited': False,
+                    'in_reply_to_status_id': None,
+                    'in_reply_to_user_id': None,
+                    'user': {'id': user, 'screen_name': 'user%d' % user,
+                             'name': 'User %d' % user,
+                             'location': 'Somewhere',
+                             'description': "Some user of Twitter",
+                             'url': 'http://example.com/',
+                             'profile_image_url':
+                                 'http://example.com/%d.png' % user,
+                             'protected': False, 'followers_count': 10,
+                             'friends_count': 20, 'statuses_count': 5,
+                             'created_at': 'Mon Jun 15 10:00:00 +0000 2009',
+                             'time_zone': None, 'utc_offset': None}})
+        yield simplejson.dumps(statuses)
+
+def resident():
+    # Return the resident memory of this process, in bytes.
+    return int(file('/proc/self/statm').read().split()[1]) * 4096
+
+def measure(way, tweets):
+    # Build TWEETS strips the given WAY, and return measurements.
+    if way == 'former':
+        maker = Former_tweet
+        sort_key = None
+    else:
+        maker = Strip.Tweet
+        sort_key = Strip.sort_key
+    gc.collect()
+    base = resident()
+    strips = []
+    for json in pages(tweets):
+        strips.extend(map(maker, twyt.data.StatusList(json)))
+    gc.collect()
+    memory = resident() - base
+    random.Random(0).shuffle(strips)
+    start = time.time()
+    for counter in range(5):
+        sorted(strips, key=sort_key)
+    sorting = (time.time() - start) / 5
+    everything = set(strips)
+    half = set(strips[:len(strips) // 2])
+    start = time.time()
+    for counter in range(5):
+        everything - half
+        everything & half
+    operations = (time.time() - start) / 5
+    return memory, sorting, operations
+
+def main(*arguments):
+    tweets = 100000
+    if arguments and arguments[0] == '--way':
+        way, tweets = arguments[1], int(arguments[2])
+        sys.stdout.write('%d %f %f\n' % measure(way, tweets))
+        return
+    if arguments:
+        tweets = int(arguments[0])
+    write = sys.stdout.write
+    write("%d tweets\n" % tweets)
+    write("%-10s %10s %10s %10s\n"
+          % ('Strips', 'Memory MB', 'Sort s', 'Sets s'))
+    for way in 'former', 'current':
+        output = subprocess.Popen(
+                [sys.executable, __file__, '--way', way, str(tweets)],
+                stdout=subprocess.PIPE).communicate()[0]
+        memory, sorting, operations = output.split()
+        write("%-10s %10.1f %10.3f %10.3f\n"
+              % (way, int(memory) / 1e6, float(sorting),
+                 float(operations)))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
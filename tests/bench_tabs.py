@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+
+"""\
+Compare counted deltas through set operations with full recomputation.
+
+Usage: python tests/bench_tabs.py [MEMBERS [ROUNDS]]
+
+Two follower tabs of MEMBERS users each, overlapping by half, feed a
+union, an intersection and a difference.  Each of ROUNDS rounds adds
+100 new users to both tabs, then discards them from the first one.
+Operations either follow these deltas through their counts, or get
+recomputed from their inputs after each delta.  The report gives the
+time to build the operations, the time per delta, and whether each
+operation ends equal to a recomputation from scratch.
+"""
+
+__metaclass__ = type
+import os, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from TweeTabs import Common
+Common.headless = True
+Common.configdir = tempfile.mkdtemp()
+from TweeTabs import Tab, Strip, Twitter
+
+class Followers(Tab.Preset):
+    strip_type = Strip.User
+
+    def change(self, added, discarded):
+        # Go as a source does, with no recomputation.
+        self.preset_strips |= added
+        self.preset_strips -= discarded
+        self.add_strips(added)
+        self.discard_strips(discarded)
+
+def expected(tab):
+    first, second = [input.strips for input in tab.inputs]
+    if isinstance(tab, Tab.Union):
+        return first | second
+    if isinstance(tab, Tab.Intersection):
+        return first & second
+    return first - second
+
+def run(users, members, rounds, recompute, write):
+    Tab.Tab.registry.clear()
+    first = Followers()
+    second = Followers()
+    first.change(set(users[:members]), set())
+    second.change(set(users[members // 2:members // 2 + members]), set())
+    start = time.time()
+    operations = [Tab.Union(first, second), Tab.Intersection(first, second),
+                  Tab.Difference(first, second)]
+    building = time.time() - start
+    fresh = members // 2 + members
+    deltas = 0
+    start = time.time()
+    for counter in range(rounds):
+        strips = set(users[fresh:fresh + 100])
+        fresh += 100
+        for tab, added, discarded in ((second, strips, ()),
+                                      (first, strips, ()),
+                                      (first, (), strips)):
+            tab.change(set(added), set(discarded))
+            if recompute:
+                Tab.propagation.start()
+                try:
+                    for operation in operations:
+                        operation.refresh()
+                finally:
+                    Tab.propagation.end()
+            deltas += 1
+    elapsed = time.time() - start
+    correct = all(operation.strips == expected(operation)
+                  for operation in operations)
+    if recompute:
+        name = 'recomputed'
+    else:
+        name = 'counted'
+    write("%-12s %10.2f %10.2f %8s\n"
+          % (name, building, 1000 * elapsed / deltas, correct))
+    for tab in operations + [first, second]:
+        tab.close()
+
+def main(*arguments):
+    members = 100000
+    rounds = 20
+    if arguments:
+        members = int(arguments[0])
+    if len(arguments) > 1:
+        rounds = int(arguments[1])
+    users = [Strip.User(Twitter.dummy_user(id))
+             for id in range(members // 2 + members + 100 * rounds)]
+    write = sys.stdout.write
+    write("%d members per tab, %d deltas of 100 users\n"
+          % (members, 3 * rounds))
+    write("%-12s %10s %10s %8s\n"
+          % ('Operations', 'Build s', 'Delta ms', 'Correct'))
+    run(users, members, rounds, False, write)
+    run(users, members, rounds, True, write)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+
+"""\
+Check that a budget gets nearly all used, and never exceeded.
+
+Usage: python tests/check_limiter.py [LIMIT [WINDOWS]]
+
+A client takes hits as soon as Budget.wait allows, over WINDOWS windows
+of a budget of LIMIT hits, in simulated time.  Twitter is simulated as
+counting hits per window, and refusing those over the limit.  The check
+fails on any refused hit, or if some window uses less than 99% of its
+budget.  Saving then restoring the limiter should keep the budget.
+"""
+
+__metaclass__ = type
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from TweeTabs import Limiter
+
+def main(*arguments):
+    limit = 150
+    windows = 3
+    if arguments:
+        limit = int(arguments[0])
+    if len(arguments) > 1:
+        windows = int(arguments[1])
+    write = sys.stdout.write
+    window = Limiter.Budget.window
+    start = 1245000000.0
+    budget = Limiter.Budget('auth', limit)
+    budget.update(limit, limit, start + window, start)
+    now = start
+    hits = [0] * windows
+    violations = 0
+    while True:
+        now += budget.wait(now)
+        index = int((now - start) // window)
+        if index >= windows:
+            break
+        if hits[index] < limit:
+            hits[index] += 1
+        else:
+            violations += 1
+        budget.consume(now)
+    errors = violations
+    for index, count in enumerate(hits):
+        write("Window %d: %d/%d hits\n" % (index + 1, count, limit))
+        if count < 0.99 * limit:
+            errors += 1
+    write("%d limit violations\n" % violations)
+
+    # A new session should resume from the saved state.
+    limiter = Limiter.Limiter()
+    limiter.budgets['auth'] = budget
+    limiter.file_name = os.path.join(tempfile.mkdtemp(), 'rate-limits')
+    limiter.save()
+    restored = Limiter.Limiter()
+    restored.restore(limiter.file_name)
+    copy = restored['auth']
+    if (copy.limit, copy.remaining, round(copy.reset, 3)) != (
+            budget.limit, budget.remaining, round(budget.reset, 3)):
+        write("Restored %s, reset %s, instead of %s, reset %s\n"
+              % (copy, copy.reset, budget, budget.reset))
+        errors += 1
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+
+"""\
+Stress scheduler locks with many threads contending on overlapping locks.
+
+Usage: python tests/check_locks.py [THREADS [LOCKS]]
+
+THREADS threads each need one to three of LOCKS locks, and hold them
+over a few random delays, in simulated time.  Some owners get cancelled
+on the way.  Then, threads granted their locks together get cancelled
+by the first of them to run.  The check fails if two threads ever hold a same lock, if
+a thread waits while all its locks are free, or if some thread never
+finishes.  It also reports how long the run took for real.
+"""
+
+__metaclass__ = type
+import os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from TweeTabs import Scheduler
+
+class Checker:
+
+    def __init__(self, write):
+        self.write = write
+        # From lock to the name of the thread body holding it.
+        self.holders = {}
+        self.errors = 0
+        self.finished = 0
+        # Becomes True once all threads got created.
+        self.stopping = False
+
+    def error(self, message):
+        self.errors += 1
+        if self.errors <= 10:
+            self.write(message + '\n')
+
+    def body_thread(self, name, locks, generator):
+        for lock in locks:
+            if lock in self.holders:
+                self.error("%s got %s, held by %s"
+                           % (name, lock, self.holders[lock]))
+            self.holders[lock] = name
+        try:
+            for counter in range(generator.randint(1, 3)):
+                yield generator.uniform(0, 0.5)
+        finally:
+            for lock in locks:
+                if self.holders.get(lock) == name:
+                    del self.holders[lock]
+        self.finished += 1
+
+    def waiters_thread(self, period):
+        # Between events, no waiting thread may have all its locks free.
+        scheduler = Scheduler.scheduler
+        while not self.stopping or len(scheduler.threads) > 1:
+            for lock, waiters in scheduler.lock_waiters.iteritems():
+                for thread in waiters:
+                    if not any(lock in scheduler.granted_locks
+                               for lock in thread.locks):
+                        self.error("%s waits with all its locks free"
+                                   % thread)
+            yield period
+
+def check_cancel_on_grant(checker, backend, rounds=100):
+    # A thread releases two locks, each awaited by another thread, so both
+    # get granted at once; the first to run cancels the second one.
+    scheduler = Scheduler.scheduler
+    cancelled = []
+
+    def holder_thread():
+        yield 0.1
+
+    def canceller_thread(victim):
+        victim[0].cancel()
+        cancelled.append(victim[0])
+        yield 0
+
+    def victim_thread():
+        checker.error("cancelled thread ran anyway")
+        yield 0
+
+    for counter in range(rounds):
+        first, second = 'first%d' % counter, 'second%d' % counter
+        victim = []
+        Scheduler.Thread(holder_thread(), (first, second))
+        Scheduler.Thread(canceller_thread(victim), first)
+        victim.append(Scheduler.Thread(victim_thread(), second))
+    backend.run(backend.now() + 1)
+    if len(cancelled) != rounds:
+        checker.error("%d victims cancelled, out of %d"
+                      % (len(cancelled), rounds))
+    if not all(thread.finished for thread in cancelled):
+        checker.error("cancelled victims did not finish")
+
+def main(*arguments):
+    threads = 5000
+    locks = 50
+    if arguments:
+        threads = int(arguments[0])
+    if len(arguments) > 1:
+        locks = int(arguments[1])
+    write = sys.stdout.write
+    backend = Scheduler.Virtual_backend()
+    scheduler = Scheduler.scheduler
+    scheduler.backend = backend
+    scheduler.executor = Scheduler.Executor(0)
+    checker = Checker(write)
+    generator = random.Random(0)
+    names = ['lock%d' % counter for counter in range(locks)]
+    owners = range(20)
+    cancelled = 0
+    start = time.time()
+    Scheduler.Thread(checker.waiters_thread(0.05))
+    for counter in range(threads):
+        wanted = tuple(generator.sample(names, generator.randint(1, 3)))
+        Scheduler.Thread(checker.body_thread('body%d' % counter, wanted,
+                                             generator),
+                         wanted, owner=generator.choice(owners))
+        if counter % 500 == 499:
+            # Let time pass, then cancel some owner's threads.
+            backend.run(backend.now() + 1)
+            owner = generator.choice(owners)
+            cancelled += len(scheduler.owned_threads.get(owner, ()))
+            scheduler.cancel_owner(owner)
+    checker.stopping = True
+    # Threads wrongly left waiting would keep the checker going forever.
+    backend.run(backend.now() + 3600)
+    elapsed = time.time() - start
+    check_cancel_on_grant(checker, backend)
+    if scheduler.granted_locks or scheduler.lock_waiters:
+        checker.error("locks still granted or awaited at end")
+    if checker.finished + cancelled != threads:
+        checker.error("%d threads finished, %d cancelled, out of %d"
+                      % (checker.finished, cancelled, threads))
+    grants = sum(stats['grants']
+                 for stats in scheduler.lock_stats.itervalues())
+    write("%d threads on %d locks: %d finished, %d cancelled,"
+          " %d grants, %.2f s, %d errors\n"
+          % (threads, locks, checker.finished, cancelled, grants,
+             elapsed, checker.errors))
+    if checker.errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
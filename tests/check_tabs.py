@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright © 2009 Progiciels Bourbeau-Pinard inc.
+# François Pinard <pinard@iro.umontreal.ca>, 2009.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.  */
+
+
+"""\
+Check incremental tab propagation against full recomputation.
+
+Usage: python tests/check_tabs.py [TRIALS]
+
+Random graphs of preset tabs and set operations get random changes:
+strips added or discarded, tabs frozen or unfrozen, users described or
+renamed, which replaces their previous strip everywhere, or merged into
+another strip already held.  After each change, every operation
+not following a frozen tab must hold what a full recomputation from its
+inputs gives.  Runs headless, on a virtual backend.
+"""
+
+__metaclass__ = type
+import os, random, sys, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from TweeTabs import Common
+Common.headless = True
+Common.configdir = tempfile.mkdtemp()
+from TweeTabs import Scheduler, Tab, Strip, Twitter
+import twyt.data
+
+class Preset(Tab.Preset):
+    strip_type = Strip.User
+
+    def change(self, added, discarded):
+        self.preset_strips |= added
+        self.preset_strips -= discarded
+        self.refresh()
+
+def expected(tab):
+    # Recompute the strips of TAB from the strips of its inputs.
+    inputs = [input.strips for input in tab.inputs]
+    if not inputs:
+        return set()
+    if isinstance(tab, Tab.Union):
+        return set().union(*inputs)
+    if isinstance(tab, Tab.Intersection):
+        return set.intersection(*inputs)
+    strips = set(inputs[0])
+    for strips_ in inputs[1:]:
+        strips -= strips_
+    return strips
+
+def following_frozen(tab):
+    return tab.frozen or any(map(following_frozen, tab.inputs))
+
+def trial(seed, write):
+    # Return the number of mismatches for the graph made from SEED.
+    generator = random.Random(seed)
+    Tab.Tab.registry.clear()
+    users = {}
+    for id in range(60):
+        users[id] = Strip.User(Twitter.dummy_user(id))
+    presets = [Preset() for counter in range(generator.randint(1, 4))]
+    tabs = list(presets)
+    operations = []
+    for counter in range(generator.randint(1, 6)):
+        maker = generator.choice((Tab.Union, Tab.Intersection,
+                                  Tab.Difference))
+        inputs = generator.sample(tabs, generator.randint(1,
+                                                          min(3, len(tabs))))
+        tab = maker(*inputs)
+        tabs.append(tab)
+        operations.append(tab)
+    mismatches = 0
+    for step in range(60):
+        choice = generator.random()
+        if choice < 0.4:
+            strips = set(generator.sample(users.values(),
+                                          generator.randint(1, 8)))
+            generator.choice(presets).change(strips, set())
+        elif choice < 0.75:
+            strips = set(generator.sample(users.values(),
+                                          generator.randint(1, 8)))
+            generator.choice(presets).change(set(), strips)
+        elif choice < 0.85:
+            id = generator.choice(users.keys())
+            old = users[id]
+            users[id] = Strip.User(twyt.data.User({
+                    'id': id,
+                    'screen_name': 'user%d_%d' % (id, step)}))
+            for preset in presets:
+                if old in preset.preset_strips:
+                    write("%d/%d: %s still within %s\n"
+                          % (seed, step, old, preset))
+                    mismatches += 1
+        elif choice < 0.9:
+            id, other = generator.sample(users.keys(), 2)
+            old = users.pop(id)
+            Tab.replace_strip(old, users[other])
+            for preset in presets:
+                if old in preset.preset_strips:
+                    write("%d/%d: %s still within %s\n"
+                          % (seed, step, old, preset))
+                    mismatches += 1
+        else:
+            tab = generator.choice(operations)
+            if tab.frozen:
+                tab.unfreeze()
+            else:
+                tab.freeze()
+        Scheduler.scheduler.backend.run()
+        for tab in operations:
+            if not following_frozen(tab) and tab.strips != expected(tab):
+                write("%d/%d: %s differs\n" % (seed, step, tab))
+                mismatches += 1
+    for tab in operations:
+        tab.unfreeze()
+    for tab in operations:
+        if tab.strips != expected(tab):
+            write("%d: %s differs at end\n" % (seed, tab))
+            mismatches += 1
+    for tab in tabs:
+        tab.close()
+    return mismatches
+
+def main(*arguments):
+    if arguments:
+        trials = int(arguments[0])
+    else:
+        trials = 300
+    Scheduler.scheduler.backend = Scheduler.Virtual_backend()
+    Scheduler.scheduler.executor = Scheduler.Executor(0)
+    write = sys.stdout.write
+    mismatches = 0
+    for seed in range(trials):
+        mismatches += trial(seed, write)
+    write("%d trials, %d mismatches\n" % (trials, mismatches))
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])